@@ -0,0 +1,328 @@
+"""Benchmarks the data pipeline of the dashboard on synthetic streaming histories.
+
+For every size, the four input csv files are generated (and kept in the work directory
+for the next runs), then each stage of streamlit_app.py is timed separately in a fresh
+process: csv and columnar loading, genre classification, merge_data, the derived time
+columns, the data prep of each chart and the serialization of the Altair specs. The
+wall time, the peak resident memory and the memory delta of each stage are written to a
+JSON file that can be compared with the results of another commit:
+
+    python benchmark.py --sizes 10000 100000 --output bench.json
+    python benchmark.py --sizes 10000 100000 --output bench_new.json --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from genre_classifier import genre_priority
+from perf import current_rss_mb
+
+default_sizes = [10000, 100000, 1000000, 10000000]
+
+timezone = "America/Los_Angeles"
+
+# words mixed with the genre keywords to make realistic specific genre names
+genre_regions = ["", "", "", "thai", "norwegian", "uk", "german", "k", "j", "latin", "french", "australian",
+                 "canadian", "chicago", "atlanta", "swedish", "brazilian", "dutch", "italian", "irish"]
+genre_styles = ["", "", "alternative", "experimental", "modern", "dark", "deep", "chamber", "dream", "neo",
+                "underground", "melodic", "progressive", "vintage", "art"]
+other_genres = ["ambient", "shoegaze", "soundtrack", "emo", "punk", "singer-songwriter", "a cappella", "reggae",
+                "ska", "gospel", "drill", "grime", "afrobeat", "cumbia", "flamenco", "new age", "world"]
+
+
+def cardinalities(n_streams):
+    """The number of artists and tracks of a history with n_streams, growing like listeners' libraries."""
+    n_artists = int(max(50, min(0.25 * n_streams, 30 * n_streams ** 0.5)))
+    n_tracks = int(max(n_artists, min(0.5 * n_streams, 6 * n_artists)))
+    return n_artists, n_tracks
+
+
+def genre_vocabulary(rng, size=1500):
+    keywords = [k for _, keywords in genre_priority for k in keywords] + other_genres
+    words = set()
+    while len(words) < size:
+        parts = [rng.choice(genre_regions), rng.choice(genre_styles), rng.choice(keywords)]
+        words.add(" ".join(p for p in parts if p))
+    return sorted(words)
+
+
+def names(prefix, n, rng):
+    """n distinct names of various lengths, some with text in brackets like real titles."""
+    suffixes = np.array(["", "", "", "", " (Remix)", " (Live)", " - Remastered", " (feat. Someone)", " [Demo]"])
+    base = np.char.add(prefix, np.arange(n).astype(str))
+    return np.char.add(base, suffixes[rng.integers(0, len(suffixes), n)])
+
+
+def generate(n_streams, directory, seed=0):
+    """Writes the four input csv files of a synthetic history with n_streams to directory.
+
+    Returns the data source name of the files (streaming_history_<name>.csv, ...).
+    """
+    data_source = "synthetic{}s{}".format(n_streams, seed)
+    paths = ["{}/{}_{}.csv".format(directory, name, data_source)
+             for name in ["streaming_history", "track_features", "artists", "genres"]]
+    if all(os.path.exists(p) for p in paths):
+        return data_source
+    rng = np.random.default_rng(seed)
+    n_artists, n_tracks = cardinalities(n_streams)
+
+    artist_names = names("Artist ", n_artists, rng)
+    track_artist = np.sort(rng.zipf(1.3, n_tracks) % n_artists)
+    track_names = names("Track ", n_tracks, rng)
+
+    # artists
+    vocabulary = np.array(genre_vocabulary(rng))
+    n_genres = rng.integers(0, 6, n_artists)
+    artist_genres = [list(vocabulary[rng.integers(0, len(vocabulary), k)]) for k in n_genres]
+    artists = pd.DataFrame({
+        "artistName": artist_names,
+        "n_listens": 0,
+        "spotify_id": np.char.add("artist", np.arange(n_artists).astype(str)),
+        "genres": [str(g) if g else "[]" for g in artist_genres],
+        "spotify_artist_name": artist_names,
+        "n_followers": rng.integers(0, 10 ** 7, n_artists).astype(float),
+        "popularity": rng.integers(0, 100, n_artists).astype(float),
+    })
+    genres = pd.DataFrame({"artistName": np.repeat(artist_names, n_genres),
+                           "genre": [g for gs in artist_genres for g in gs]})
+
+    # tracks
+    durations = rng.normal(210000, 60000, n_tracks).clip(30000, 900000).astype(int)
+    tracks = pd.DataFrame({
+        "artistName": artist_names[track_artist],
+        "trackName": track_names,
+        "n_listens": 0,
+        "spotify_id": np.char.add("track", np.arange(n_tracks).astype(str)),
+    })
+    for feat in ["danceability", "energy", "speechiness", "acousticness", "instrumentalness", "liveness", "valence"]:
+        tracks[feat] = rng.random(n_tracks).round(4)
+    tracks["key"] = rng.integers(0, 12, n_tracks).astype(float)
+    tracks["loudness"] = rng.uniform(-30, 0, n_tracks).round(3)
+    tracks["mode"] = rng.integers(0, 2, n_tracks).astype(float)
+    tracks["tempo"] = rng.uniform(60, 180, n_tracks).round(3)
+    tracks["duration_ms"] = durations.astype(float)
+    tracks["time_signature"] = 4.0
+    tracks["album"] = np.char.add("Album ", (np.arange(n_tracks) // 8).astype(str))
+    tracks["album_release_date"] = "2019-01-01"
+    tracks["album_type"] = "album"
+    tracks["explicit"] = rng.random(n_tracks) < 0.2
+    tracks["popularity"] = rng.integers(0, 100, n_tracks)
+    tracks["preview_url"] = np.char.add("https://p.scdn.co/mp3-preview/", tracks["spotify_id"].to_numpy().astype(str))
+    tracks["artists"] = tracks["artistName"]
+
+    # streams, the tracks are listened to with a long tailed popularity
+    stream_track = (rng.zipf(1.2, n_streams) - 1) % n_tracks
+    rng.shuffle(stream_track)
+    # about 40 streams a day, over at most five years
+    span_seconds = int(min(max(30, n_streams / 40), 5 * 365) * 86400)
+    start = pd.Timestamp("2019-01-01").value // 10 ** 9
+    end_time = pd.to_datetime(np.sort(start + rng.integers(0, span_seconds, n_streams)) // 60 * 60, unit="s")
+    skipped = rng.random(n_streams) < 0.4
+    ms_played = np.where(skipped, rng.exponential(8000, n_streams),
+                         durations[stream_track] * rng.uniform(0.5, 1.05, n_streams)).astype(int)
+    utc = end_time.tz_localize("UTC")
+    local = utc.tz_convert(timezone)
+    season_num = (local.month % 12 + 3) // 3
+    streams = pd.DataFrame({
+        "endTime": end_time,
+        "artistName": tracks["artistName"].to_numpy()[stream_track],
+        "trackName": track_names[stream_track],
+        "msPlayed": ms_played,
+        "endTime_utc": utc,
+        "endTime_loc": local.strftime("%Y-%m-%d %H:%M:%S%z").str.replace(r"(\d\d)(\d\d)$", r"\1:\2", regex=True),
+        "day_of_week": local.day_name(),
+        "weekday": (local.dayofweek // 5 == 1).astype(int),
+        "season_num": season_num,
+        "season": np.array(["winter", "spring", "summer", "fall"])[season_num - 1],
+        "hour_of_day": local.hour,
+    })
+    tracks["n_listens"] = np.bincount(stream_track, minlength=n_tracks)
+    artists["n_listens"] = np.bincount(track_artist[stream_track], minlength=n_artists)
+
+    os.makedirs(directory, exist_ok=True)
+    for df, path in zip([streams, tracks, artists, genres], paths):
+        df.to_csv(path, index=False)
+    return data_source
+
+
+class StageTimer:
+    """Times named stages and samples the resident memory while they run."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stages = []
+
+    def run(self, name, function, **extra):
+        peak = [current_rss_mb()]
+        before = peak[0]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(self.interval):
+                peak[0] = max(peak[0], current_rss_mb())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            result = function()
+        finally:
+            seconds = time.perf_counter() - start
+            done.set()
+            sampler.join()
+        after = current_rss_mb()
+        self.stages.append(dict({"stage": name, "seconds": seconds, "peak_rss_mb": max(peak[0], after),
+                                 "rss_delta_mb": after - before}, **extra))
+        return result
+
+
+def run_size(n_streams, directory, seed, max_serialize_rows):
+    """Runs every stage for one size and returns its results."""
+    import chart_data
+    import charts
+    from data_store import clear_cache, load_table
+    from genre_classifier import classify_artists
+    from pipeline import add_time_features, count_weeks, merge_tables
+
+    timer = StageTimer()
+    data_source = timer.run("generate", lambda: generate(n_streams, directory, seed))
+    urls = {name: "{}/{}_{}.csv".format(directory, name, data_source)
+            for name in ["streaming_history", "track_features", "artists", "genres"]}
+
+    for name, url in urls.items():
+        timer.run("csv_load:" + name, lambda: pd.read_csv(url))
+    for name, url in urls.items():
+        clear_cache(url)
+        timer.run("columnar_load_cold:" + name, lambda: load_table(url))
+    tables = {name: timer.run("columnar_load_warm:" + name, lambda: load_table(url)) for name, url in urls.items()}
+
+    artists = timer.run("genre_classification", lambda: classify_artists(tables["artists"], tables["genres"]))
+    merged = timer.run("merge_data", lambda: merge_tables(tables["streaming_history"], tables["track_features"], artists))
+    df = timer.run("time_features", lambda: add_time_features(merged))
+
+    prepared = {
+        "played_vs_duration": timer.run("chart_prep:played_vs_duration", lambda: chart_data.duration_cutoff_table(
+            chart_data.duration_cutoff_cube(df))),
+        "heat_map": timer.run("chart_prep:heat_map", lambda: chart_data.heat_map_counts(
+            chart_data.heat_map_cube(df), 20 * chart_data.ms_per_second)),
+        "streamgraph": timer.run("chart_prep:streamgraph", lambda: chart_data.genre_hour_minutes(df, count_weeks(df))),
+        "violin": timer.run("chart_prep:violin", lambda: chart_data.genre_hour_density(chart_data.genre_minute_counts(df))),
+        "metric": timer.run("chart_prep:metric", lambda: chart_data.metric_points(df, "danceability")),
+    }
+    prepared["metric_track_names"] = timer.run("chart_prep:metric_track_names", lambda: chart_data.metric_track_names(
+        df, prepared["metric"]))
+    prepared["metric_cells"] = None
+    if len(prepared["metric"]) > chart_data.metric_max_points:
+        prepared["metric_cells"] = timer.run("chart_prep:metric_cells", lambda: chart_data.metric_cells(
+            prepared["metric"], "danceability"))
+        prepared["metric"] = timer.run("chart_prep:metric_sample", lambda: chart_data.metric_sample(
+            prepared["metric"], prepared["metric_track_names"]))
+        prepared["metric_track_names"] = chart_data.sample_track_names(prepared["metric_track_names"],
+                                                                       prepared["metric"])
+    specs = {
+        "played_vs_duration": lambda: charts.played_vs_duration_chart(prepared["played_vs_duration"], 20.),
+        "heat_map": lambda: charts.heat_map_chart(prepared["heat_map"]),
+        "genre_time": lambda: charts.genre_time_charts(prepared["streamgraph"], prepared["violin"]),
+        "metric": lambda: charts.metric_charts(prepared["metric"], prepared["metric_track_names"], "danceability",
+                                               prepared["metric_cells"]),
+    }
+    chart_rows = {"played_vs_duration": len(prepared["played_vs_duration"]), "heat_map": len(prepared["heat_map"]),
+                  "genre_time": len(prepared["streamgraph"]) + len(prepared["violin"]), "metric": len(prepared["metric"])}
+    for name, build in specs.items():
+        if chart_rows[name] > max_serialize_rows:
+            timer.stages.append({"stage": "serialize:" + name, "skipped": True, "rows": chart_rows[name]})
+            continue
+        payload = timer.run("serialize:" + name, lambda: chart_data.chart_payload_bytes(charts.chart_spec(build())))
+        timer.stages[-1].update({"rows": chart_rows[name], "payload_bytes": payload})
+
+    return {
+        "streams": n_streams,
+        "tables": {name: len(table) for name, table in tables.items()},
+        "merged_rows": len(df),
+        "merged_memory_mb": df.memory_usage(deep=True).sum() / 2 ** 20,
+        "stages": timer.stages,
+        "process_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """A table of the seconds of each stage relative to a previous results file."""
+    rows = []
+    old = {(r["streams"], s["stage"]): s for r in previous["results"] for s in r["stages"]}
+    for r in results["results"]:
+        for s in r["stages"]:
+            before = old.get((r["streams"], s["stage"]))
+            if before and "seconds" in before and "seconds" in s:
+                rows.append({"streams": r["streams"], "stage": s["stage"], "before_s": before["seconds"],
+                             "after_s": s["seconds"], "ratio": s["seconds"] / before["seconds"] if before["seconds"] else np.nan})
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes, help="numbers of streams")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "spotify_vizzz_bench"),
+                        help="directory of the generated csv files")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-serialize-rows", type=int, default=2000000,
+                        help="skip serializing charts whose data has more rows")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="a previous results file to compare with")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_size(args.single, args.workdir, args.seed, args.max_serialize_rows)))
+        return
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": pd.Timestamp.now(tz="UTC").isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "versions": {m.__name__: m.__version__ for m in [np, pd]},
+        "seed": args.seed,
+        "results": [],
+    }
+    for n in args.sizes:
+        # each size runs in its own process so that its peak memory is not hidden by the previous sizes
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--single", str(n),
+                                          "--workdir", args.workdir, "--seed", str(args.seed),
+                                          "--max-serialize-rows", str(args.max_serialize_rows)],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        results["results"].append(result)
+        print("{:>10,} streams".format(n))
+        for stage in result["stages"]:
+            if stage.get("skipped"):
+                print("    {:<40} skipped ({:,} rows)".format(stage["stage"], stage["rows"]))
+            else:
+                print("    {:<40} {:>9.3f}s  peak {:>8.1f} MB".format(stage["stage"], stage["seconds"], stage["peak_rss_mb"]))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            table = compare(results, json.load(f))
+        print(table.to_string(index=False) if len(table) else "No stage in common with " + args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+import json
+
+from altair.utils import sanitize_dataframe
+import numpy as np
+import pandas as pd
+
+# unit conversions
+ms_per_second = 1000
+seconds_per_minute = 60
+minutes_per_hour = 60
+
+days_ordered = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# The percent listened is clipped to [0, 110] and binned in steps of 10%
+percent_bin_step = 10
+percent_max = 110
+# The cutoff slider of the duration chart goes from 0 to 8 minutes in steps of half a second
+cutoff_step_ms = 500
+max_cutoff_seconds = 8 * seconds_per_minute
+# The music metrics of the scatter plot and histogram
+music_metrics = ["danceability", "energy", "valence", "instrumentalness", "speechiness", "acousticness"]
+# Above metric_max_points points, the music metric scatter plot shows the counts of cells of
+# metric_cell_minutes by metric_bin_step (the bin step of its histogram) per genre instead, with
+# a sample of metric_max_points points that are drawn inside its brush
+metric_bin_step = 0.05
+metric_cell_minutes = 15
+metric_max_points = 5000
+# The densities of the violin plot are evaluated from 0 to 24 hours every 7.5 minutes, with a
+# kernel bandwidth in hours or estimated per genre with Scott's rule like Vega does ("scott")
+minutes_per_day = 24 * minutes_per_hour
+violin_grid_step = 0.125
+violin_bandwidths = ["scott", 0.25, 0.5, 1.0, 2.0]
+
+
+def percent_listened(df):
+    return (df["msPlayed"] / df["duration_ms"]).clip(0, 1.1) * 100.
+
+
+def n_cutoffs():
+    """The number of positions of the cutoff slider, 0 to max_cutoff_seconds included."""
+    return max_cutoff_seconds * ms_per_second // cutoff_step_ms + 1
+
+
+def cutoff_index(cutoff_seconds):
+    """The position of a cutoff (in seconds) on the half second cutoff grid."""
+    return int(np.clip(round(cutoff_seconds * ms_per_second / cutoff_step_ms), 0, n_cutoffs() - 1))
+
+
+def duration_cutoff_cube(df):
+    """Cumulative counts of streams per percent listened bin for every cutoff of the slider.
+
+    Returns an array of shape (percent bins, n_cutoffs() + 1) whose entry [b, j] is the
+    number of streams in bin b with msPlayed < j * 500, computed from a single 2-D histogram
+    of the percent bin and floor(msPlayed / 500). The last column is the total of each bin.
+    Streams of tracks without a duration are left out, as they were dropped by the binning
+    in the browser.
+    """
+    n_bins = percent_max // percent_bin_step
+    percent = percent_listened(df).to_numpy()
+    keep = ~np.isnan(percent)
+    percent_bin = np.minimum(percent[keep] // percent_bin_step, n_bins - 1).astype(np.int64)
+    # msPlayed < j * 500 is the same as floor(msPlayed / 500) < j, and streams longer than the
+    # largest cutoff are never below it, so they all go in the last column of the histogram
+    n = n_cutoffs()
+    half_seconds = np.minimum(df["msPlayed"].to_numpy()[keep] // cutoff_step_ms, n - 1).astype(np.int64)
+    hist = np.bincount(percent_bin * n + half_seconds, minlength=n_bins * n).reshape(n_bins, n)
+    cube = np.zeros((n_bins, n + 1), dtype=np.int64)
+    cube[:, 1:] = hist.cumsum(axis=1)
+    return cube
+
+
+def duration_cutoff_table(cube):
+    """The long form of duration_cutoff_cube for the chart, one row per bin and cutoff.
+
+    The end of each bin is left for the chart to compute, to keep the table small.
+    """
+    less, totals = cube[:, :-1], cube[:, -1:]
+    n_bins, n = less.shape
+    percent_start = np.repeat(np.arange(n_bins) * percent_bin_step, n)
+    return pd.DataFrame({
+        "percent_start": percent_start.astype(np.int16),
+        "cutoff_index": np.tile(np.arange(n), n_bins).astype(np.int16),
+        "n_less": less.ravel(),
+        "n_more": (totals - less).ravel(),
+    })
+
+
+def heat_map_cube(df):
+    """Counts of streams per local date, hour and ceil(msPlayed / 500).
+
+    msPlayed > j * 500 is the same as ceil(msPlayed / 500) > j, so the heat map counts
+    for any cutoff of the half second grid are sums over this table, which only has a row
+    for each distinct (date, hour, half second) of the data.
+    """
+    n = n_cutoffs()
+    played_half_seconds = np.minimum(-(-df["msPlayed"].to_numpy() // cutoff_step_ms), n).astype(np.int16)
+    keys = pd.DataFrame({"date": df["date"].to_numpy(), "hour": df["hour"].to_numpy(),
+                         "played_half_seconds": played_half_seconds})
+    return keys.groupby(["date", "hour", "played_half_seconds"]).size().reset_index(name="count")
+
+
+def add_heat_map_cubes(cube, delta):
+    """The heat_map_cube of the streams of two tables, from the heat_map_cube of each.
+
+    The rows of cube are sorted by date, only those from the first date of delta on are
+    summed with delta, the earlier ones are kept as they are.
+    """
+    if delta.empty:
+        return cube
+    start = cube["date"].searchsorted(delta["date"].min())
+    tail = pd.concat([cube.iloc[start:], delta]).groupby(["date", "hour", "played_half_seconds"])["count"].sum()
+    return pd.concat([cube.iloc[:start], tail.reset_index()], ignore_index=True)
+
+
+def heat_map_counts(cube, ms_cutoff):
+    """Counts of the streams longer than ms_cutoff per local date, day of week and hour.
+
+    ms_cutoff is rounded to the half second grid of heat_map_cube. The date range brush of
+    the heat map selects on 'date', the top chart then sums the counts of the selected
+    dates per day and hour.
+    """
+    played = cube[cube["played_half_seconds"] > cutoff_index(ms_cutoff / ms_per_second)]
+    counts = played.groupby(["date", "hour"])["count"].sum().reset_index()
+    counts["day_of_week"] = counts["date"].dt.day_name()
+    return counts[["date", "day_of_week", "hour", "count"]]
+
+
+def genre_hour_played(df):
+    """The total msPlayed in each hour of the day of each broad genre.
+
+    Every (hour, genre) pair is present, with 0 when the genre was not played in that
+    hour, so that the stacked areas of the streamgraph line up. The totals are integers,
+    so the totals of two sets of streams add up to those of their union exactly.
+    """
+    sums = df["msPlayed"].astype(np.int64).groupby([df["hour"], df["broad_genres"]], observed=True).sum()
+    genres = sorted(df["broad_genres"].dropna().unique())
+    full = pd.MultiIndex.from_product([range(24), genres], names=["hour", "broad_genres"])
+    return sums.reindex(full, fill_value=0).reset_index(name="msPlayed")
+
+
+def add_genre_hour_played(played, delta):
+    """The genre_hour_played of the streams of two tables, from the genre_hour_played of each."""
+    genres = sorted(set(played["broad_genres"]) | set(delta["broad_genres"]))
+    full = pd.MultiIndex.from_product([range(24), genres], names=["hour", "broad_genres"])
+    total = sum(p.set_index(["hour", "broad_genres"])["msPlayed"].reindex(full, fill_value=0) for p in [played, delta])
+    return total.astype(np.int64).reset_index(name="msPlayed")
+
+
+def played_minutes_per_week(played, n_weeks):
+    """The average minutes played per week of each row of genre_hour_played."""
+    minutes = played["msPlayed"] / (ms_per_second * seconds_per_minute) / n_weeks
+    return pd.DataFrame({"hour": played["hour"], "broad_genres": played["broad_genres"],
+                         "averageMinutesPlayed": minutes})
+
+
+def genre_hour_minutes(df, n_weeks):
+    """The average minutes played per week in each hour of the day, per broad genre."""
+    return played_minutes_per_week(genre_hour_played(df), n_weeks)
+
+
+def genre_minute_counts(df):
+    """The number of streams in each minute of the day (rows) of each broad genre (columns)."""
+    genres = sorted(df["broad_genres"].dropna().unique())
+    codes = pd.Categorical(df["broad_genres"], categories=genres).codes
+    minutes = df["minute_of_day"].to_numpy()
+    keep = codes >= 0
+    counts = np.bincount(codes[keep].astype(np.int64) * minutes_per_day + minutes[keep],
+                         minlength=len(genres) * minutes_per_day)
+    return pd.DataFrame(counts.reshape(len(genres), minutes_per_day).T, columns=pd.Index(genres, name="broad_genres"))
+
+
+def add_genre_minute_counts(counts, delta):
+    """The genre_minute_counts of the streams of two tables, from the genre_minute_counts of each."""
+    genres = pd.Index(sorted(set(counts.columns) | set(delta.columns)), name="broad_genres")
+    return counts.reindex(columns=genres, fill_value=0) + delta.reindex(columns=genres, fill_value=0)
+
+
+def weighted_quantile(values, weights, p):
+    """The quantile p of values repeated weights times, interpolated like d3.quantile."""
+    order = np.argsort(values)
+    values, cumulative = values[order], np.cumsum(weights[order])
+    position = (cumulative[-1] - 1) * p
+    lower = int(position)
+    at = lambda i: values[np.searchsorted(cumulative, i, side="right")]
+    return at(lower) + (at(min(lower + 1, cumulative[-1] - 1)) - at(lower)) * (position - lower)
+
+
+def scott_bandwidth(values, weights):
+    """The kernel bandwidth Vega estimates for values repeated weights times (Scott's rule)."""
+    n = weights.sum()
+    mean = np.dot(values, weights) / n
+    std = np.sqrt(np.dot((values - mean) ** 2, weights) / (n - 1)) if n > 1 else 0.
+    q1, q3 = weighted_quantile(values, weights, 0.25), weighted_quantile(values, weights, 0.75)
+    v = min(std, (q3 - q1) / 1.34) or std or abs(q1) or 1.
+    return 1.06 * v * n ** -0.2
+
+
+def genre_hour_density(minute_counts, bandwidth="scott"):
+    """The gaussian kernel density of the hour of the day of each genre, for the violin plot.
+
+    minute_counts is genre_minute_counts(df). The hour of the day only takes one value per
+    minute, so the density is a sum over the 1440 minutes weighted by their counts, whatever
+    the number of streams. The densities are evaluated every violin_grid_step hours from 0
+    to 24 with a bandwidth of bandwidth hours, or the one of Vega's density transform for
+    "scott", and returned with the columns broad_genres, hour_of_day and density.
+    """
+    hours = 24 - np.arange(minutes_per_day) / minutes_per_hour
+    grid = np.arange(0, 24 + violin_grid_step / 2, violin_grid_step)
+    tables = []
+    for genre, weights in minute_counts.items():
+        weights = weights.to_numpy()
+        n = weights.sum()
+        if n == 0:
+            continue
+        h = scott_bandwidth(hours, weights) if bandwidth == "scott" else bandwidth
+        kernel = np.exp(-0.5 * ((grid[:, None] - hours[None, :]) / h) ** 2) / (h * np.sqrt(2 * np.pi))
+        tables.append(pd.DataFrame({"broad_genres": genre, "hour_of_day": grid, "density": kernel @ weights / n}))
+    if not tables:
+        return pd.DataFrame(columns=["broad_genres", "hour_of_day", "density"])
+    return pd.concat(tables, ignore_index=True)
+
+
+def track_keys(df):
+    """An integer key of the (artist, track) pair of every row, the merge's 'track_id' when it has one."""
+    if "track_id" in df:
+        return df["track_id"].to_numpy()
+    return df.groupby(["artistName", "trackName"], sort=False, observed=True).ngroup().to_numpy()
+
+
+def metric_points(df, metric):
+    """The points of the music metric scatter plot, one per minute of the day and track.
+
+    The metric is a property of the track, so the streams of a track in the same minute
+    are the same point and are only counted. The names of the tracks are left to
+    metric_track_names, the chart looks them up for its tooltips.
+    """
+    points = pd.DataFrame({"minute_of_day": df["minute_of_day"].to_numpy(), metric: df[metric].to_numpy(),
+                           "broad_genres": df["broad_genres"].to_numpy(), "track_id": track_keys(df)})
+    grouped = points.dropna(subset=[metric]).groupby(["minute_of_day", "track_id"], sort=False)
+    points = grouped[[metric, "broad_genres"]].first()
+    points["count"] = grouped.size()
+    return points.reset_index()
+
+
+def point_keys(points):
+    """An integer key of the (minute_of_day, track_id) of every point."""
+    return points["minute_of_day"].to_numpy().astype(np.int64) << 32 | points["track_id"].to_numpy().astype(np.int64)
+
+
+def add_counts(points, delta):
+    """The count of every point plus the count of the same point in delta, and whether each point
+    of delta is one of points."""
+    positions = pd.Index(point_keys(points)).get_indexer(point_keys(delta))
+    found = positions >= 0
+    counts = points["count"].to_numpy().copy()
+    counts[positions[found]] += delta["count"].to_numpy()[found]
+    return counts, found
+
+
+def add_metric_points(points, delta):
+    """The metric_points of the streams of two tables, from the metric_points of each.
+
+    The tables must have the same track ids. Only the points of delta are looked up: the
+    counts of those that are in points are added to and the others go last, in the order
+    metric_points gives them (the first stream of each point first).
+    """
+    counts, found = add_counts(points, delta)
+    return pd.concat([points.assign(count=counts), delta[~found]], ignore_index=True)
+
+
+def metric_track_names(df, points):
+    """The artist and track name of every track of points, the tooltip lookup of the scatter plot."""
+    names = pd.DataFrame({"track_id": track_keys(df), "artistName": df["artistName"].to_numpy(),
+                          "trackName": df["trackName"].to_numpy()})
+    names = names.drop_duplicates("track_id")
+    return names[names["track_id"].isin(points["track_id"].unique())].reset_index(drop=True)
+
+
+def metric_cells(points, metric):
+    """The number of streams in each cell of metric_cell_minutes by metric_bin_step per genre.
+
+    The cells are placed at their centers, with the column names of metric_points so that the
+    brush of the scatter plot selects the same ranges in both tables.
+    """
+    n_bins = int(round(1 / metric_bin_step))
+    minute_cell = points["minute_of_day"].to_numpy() // metric_cell_minutes
+    metric_bin = np.minimum(points[metric].to_numpy() // metric_bin_step, n_bins - 1)
+    cells = points["count"].groupby([minute_cell, metric_bin, points["broad_genres"]], observed=True).sum()
+    cells.index.names = ["minute_cell", "metric_bin", "broad_genres"]
+    cells = cells.reset_index()
+    return pd.DataFrame({
+        "minute_of_day": (cells["minute_cell"] + 0.5) * metric_cell_minutes,
+        metric: ((cells["metric_bin"] + 0.5) * metric_bin_step).round(3),
+        "broad_genres": cells["broad_genres"],
+        "count": cells["count"].to_numpy(),
+    })
+
+
+def add_metric_cells(cells, delta, metric):
+    """The metric_cells of the points of two tables, from the metric_cells of each."""
+    grouped = pd.concat([cells, delta], ignore_index=True).groupby(["minute_of_day", metric, "broad_genres"])
+    return grouped["count"].sum().reset_index()
+
+
+def sample_priorities(points, track_names):
+    """A hash of the minute and the artist and track names of every point.
+
+    The points are sampled in the order of their priorities, which do not depend on the
+    other points nor on the track ids.
+    """
+    rows = pd.Index(track_names["track_id"]).get_indexer(points["track_id"])
+    return pd.util.hash_pandas_object(pd.DataFrame({
+        "minute_of_day": points["minute_of_day"].to_numpy(),
+        "artistName": track_names["artistName"].to_numpy()[rows].astype(object),
+        "trackName": track_names["trackName"].to_numpy()[rows].astype(object),
+    }), index=False).to_numpy()
+
+
+def lowest_priorities(points, track_names, n):
+    """The n points of lowest sample_priorities (the first of equal ones), in their order in points."""
+    order = np.argsort(sample_priorities(points, track_names), kind="stable")[:n]
+    return points.iloc[np.sort(order)].reset_index(drop=True)
+
+
+def metric_sample(points, track_names, n=metric_max_points):
+    """At most n of the points, the same ones for the same points.
+
+    The sample is the points of lowest sample_priorities, so a point that is not in the sample
+    never gets in it when points are added, see add_metric_sample.
+    """
+    if len(points) <= n:
+        return points
+    return lowest_priorities(points, track_names, n)
+
+
+def add_metric_sample(sample, delta, new_points, track_names, n=metric_max_points):
+    """The metric_sample of points grown by delta, from the metric_sample of the points.
+
+    delta is the metric_points of the appended streams and new_points its points that were
+    not in points, which add_metric_points puts last. Only the points of the sample and the
+    new points can be in the new sample, the counts of the sampled points are updated.
+    """
+    counts, _ = add_counts(sample, delta)
+    return lowest_priorities(pd.concat([sample.assign(count=counts), new_points], ignore_index=True), track_names, n)
+
+
+def sample_track_names(track_names, sample):
+    """The rows of track_names of the tracks of sample."""
+    return track_names[track_names["track_id"].isin(sample["track_id"].unique())].reset_index(drop=True)
+
+
+def chart_payload_bytes(spec):
+    """The size of the Vega-Lite spec of charts.chart_spec with its datasets as json, as altair's
+    default data transformer would write them."""
+    datasets = {name: sanitize_dataframe(df).to_dict(orient="records") for name, df in spec["datasets"].items()}
+    return len(json.dumps(dict(spec, datasets=datasets), default=str))
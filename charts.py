@@ -0,0 +1,257 @@
+import altair as alt
+from altair import datum
+import pandas as pd
+
+from chart_data import cutoff_index, days_ordered, metric_bin_step, minutes_per_hour, percent_bin_step
+from genre_classifier import broad_genres
+
+
+def played_vs_duration_chart(cutoff_table, seconds_cutoff):
+    """The percent of each song that was listened to, colored by whether it was played for
+    less than seconds_cutoff.
+
+    cutoff_table is duration_cutoff_table(duration_cutoff_cube(df)). Only its rows of
+    seconds_cutoff are drawn, the cutoff is set by the slider of the app that also filters
+    the following charts, so the chart is built again when it moves.
+    """
+    # the number of songs below and above every possible cutoff is precomputed per 10% bin (see
+    # duration_cutoff_cube), so a cutoff only picks its rows
+    rows = cutoff_table[cutoff_table["cutoff_index"] == cutoff_index(seconds_cutoff)]
+    rows = rows.drop(columns="cutoff_index").reset_index(drop=True)
+    # make the chart whose x-axis in the ratio of milliseconds played to duration of the song (binned over steps of 0.1, meaning 10%)
+    # and whose y-axis is the count of the number of rows that fall into the ratio bin
+    # the records whose milliseconds played are less than the cutoff are colored in
+    # the width and height of the chart are specified to try to provide better visibility
+    played_vs_duration = alt.Chart(rows).mark_bar().encode(
+        alt.X("percent_start:Q", bin="binned", title="Percent of Song"),
+        alt.X2("percent_end:Q"),
+        alt.Y("count:Q", title="Count of Songs"),
+        alt.Color("played_less_than_cutoff_seconds:N", title="Songs Played for Less than Cutoff",
+                scale=alt.Scale(domain=['true', 'false'], range=['#d8b365', '#5ab4ac']), 
+                legend=alt.Legend(orient="bottom")),
+        tooltip = [alt.Tooltip("count:Q", title="Count of Songs")]
+    ).transform_fold(
+        ['n_less', 'n_more'], as_=['played_less_than_cutoff_seconds', 'count']
+    ).transform_calculate(
+        played_less_than_cutoff_seconds = alt.expr.if_(datum.played_less_than_cutoff_seconds == 'n_less', 'true', 'false'),
+        percent_end = datum.percent_start + percent_bin_step
+    ).properties(
+        title = "Percent of Song Duration Listened to per Song",
+        width = 1000,
+        height = 400
+    )
+    return played_vs_duration
+
+
+def heat_map_chart(counts):
+    """The count of songs listened to per hour and day of week, filtered by a date range brush
+    on the count of songs per day below it.
+
+    counts is heat_map_counts(heat_map_cube(df), ms_cutoff).
+    """
+    # the brush only selects dates, the counts on the y axis are aggregates of the dates
+    date_range_selection = alt.selection_interval(encodings=['x'])
+
+    # the dates are local midnights without a timezone, which reach the browser as utc
+    # timestamps, so they are binned in utc to stay on their day west of utc too
+    heat_map = alt.Chart(counts).mark_rect().encode(
+        alt.X('utcyearmonthdate(date):T', title='Date'),
+        alt.Y('sum(count):Q', title='Count of Songs Listened')
+    ).properties(
+        width = 1000,
+        height = 400
+    )
+
+    return (
+        heat_map.encode(
+            alt.X('hour:O', title="Hour of Day", scale=alt.Scale(domain = list(range(24)))),
+            alt.Y('day_of_week:O', title='Day of Week', sort=days_ordered, scale = alt.Scale(domain=days_ordered)),
+            alt.Color('sum(count):Q', title='Count of Songs Listened'),
+            tooltip = alt.Tooltip('sum(count):Q', title='Count of Songs Listened')
+        ).transform_filter(date_range_selection)
+        & heat_map.encode(alt.Color('sum(count):Q', title='Count of Songs Listened'),
+            tooltip = alt.Tooltip('sum(count):Q', title='Count of Songs Listened')).properties(height=250).add_selection(
+            date_range_selection)
+    )
+
+
+def genre_time_charts(minutes, density):
+    """The streamgraph of the average minutes played per hour and genre over the violin plot of
+    each genre's listening time of day.
+
+    minutes is genre_hour_minutes(df, n_weeks) and density genre_hour_density(genre_minute_counts(df)).
+    """
+    weird = alt.Chart(minutes).mark_area().encode(
+        alt.X('hour:Q', title="Hour of Day", scale=alt.Scale(domain=[0, 23]),
+            axis=alt.Axis(format='02d', domain=False, tickSize=0)
+        ),
+        alt.Y('sum(averageMinutesPlayed):Q', stack='center', title="Avg. Minutes Played in Hour Span"),
+        alt.Color('broad_genres:N',
+            scale=alt.Scale(scheme='tableau10'), title="Genre"
+        ),
+        tooltip=[alt.Tooltip('hour:Q', title="Hour of the day"),
+                alt.Tooltip('sum(averageMinutesPlayed):Q', title="Avg. Minutes Played"),
+                alt.Tooltip('broad_genres:N', title="Genre")]
+    ).properties(
+        width=1300,
+        height=500,
+        title="Average Time Music was Played Throughout the Day by Genre"
+    )
+
+    # the densities are computed by genre_hour_density, on the same 0 - 24 extent as Vega's
+    # density transform and by default with the same bandwidth
+    violin = alt.Chart(density).mark_area(orient='horizontal').encode(
+        y=alt.Y('hour_of_day:Q', title="Hour of Day"),
+        color=alt.Color('broad_genres:N', title="Genre", scale=alt.Scale(scheme='tableau10')),
+        x=alt.X(
+            'density:Q',
+            stack='center',
+            impute=None,
+            title=None,
+            axis=alt.Axis(labels=False, values=[0],grid=False, ticks=True),
+        ),
+        column=alt.Column(
+            'broad_genres:N',
+            title="Genre",
+            header=alt.Header(
+                titleOrient='bottom',
+                labelOrient='bottom',
+                labelPadding=0,
+            ),
+        ),
+        tooltip=[alt.Tooltip('hour_of_day:Q', title="Hour of the day"),
+                alt.Tooltip('density:Q', title="Density Minutes Played"),
+                alt.Tooltip('broad_genres:N', title="Genre")]
+    ).properties(
+        width=90,
+        title="How each genre is listened to throughout the day"
+    )
+    # .configure_facet(
+    #     spacing=0
+    # ).configure_view(
+    #     stroke=None
+    # )
+
+    return weird & violin
+
+
+def metric_charts(points, track_names, metric_dropdown, cells=None):
+    """The histogram of a music metric over the scatter plot of the metric per minute of the day.
+
+    points is metric_points(df, metric_dropdown) and track_names metric_track_names(df, points),
+    the table the tooltips look the names of the tracks up in. When cells (metric_cells(points,
+    metric_dropdown)) is given, the scatter plot shows the count of streams of each cell and the
+    histogram sums the cells, points is then only a sample of the points (metric_sample) with
+    the names of its tracks, which are drawn inside the brush.
+    """
+    input_dropdown = alt.binding_select(options=broad_genres, name = "Broad Genre: ")
+    selection = alt.selection_single(fields=['broad_genres'], bind=input_dropdown)
+
+    scatter_brush = alt.selection(type='interval')
+
+    # the x axis is the minute of the day, labelled as hours and minutes
+    x = alt.X('minute_of_day:Q', title="Hour of the Day", scale = alt.Scale(domain=[0, 24 * minutes_per_hour - 1]),
+        axis=alt.Axis(values=list(range(0, 24 * minutes_per_hour, 2 * minutes_per_hour)),
+            labelExpr="utcFormat(datum.value * 60000, '%H:%M')"))
+    y = alt.Y(metric_dropdown, type="quantitative", scale=alt.Scale(zero=False, domain=[0.0, 1.0]))
+    genre_color = alt.Color('broad_genres:N', scale=alt.Scale(scheme='tableau10'))
+
+    metric_danceability_vs_hour = alt.Chart(points if cells is None else cells).mark_bar().encode(
+        alt.X(metric_dropdown + ":Q", bin=alt.Bin(step=metric_bin_step), title=metric_dropdown, scale = alt.Scale(domain=[0.0, 1.0])),
+        alt.Y("sum(count):Q", title="Number of Songs"),
+        tooltip = [alt.Tooltip("sum(count):Q", title="Number of Songs")],
+        color = genre_color
+    ).properties(
+        width = 600,
+        height = 150
+    ).transform_filter(
+        selection
+    ).add_selection(
+        selection
+    ).transform_filter(
+        scatter_brush
+    )
+
+    # a LookupData of the table itself would be validated row by row, which takes seconds for
+    # large histories, so it refers to the table by name and the table is given in the datasets
+    # of the chart, which chart_spec sends like the data of the charts
+    names = {str(id(track_names)): track_names}
+    names_lookup = alt.LookupData(alt.NamedData(name=str(id(track_names))), 'track_id', ['artistName', 'trackName'])
+
+    # the points of the other genres are filtered out, and their tooltips with them, so the
+    # names of the tracks are looked up by the points instead of being repeated in a second layer
+    danceability_vs_hour = alt.Chart(points).mark_point().encode(
+        x=x, y=y, color=genre_color,
+        tooltip=[alt.Tooltip('artistName:N'), alt.Tooltip('trackName:N'), alt.Tooltip('count:Q', title="Streams")]
+    ).transform_filter(
+        selection
+    ).transform_lookup(
+        lookup='track_id',
+        from_=names_lookup
+    ).properties(
+        width=700, height=500
+    )
+    if cells is None:
+        return alt.vconcat(metric_danceability_vs_hour, danceability_vs_hour.add_selection(selection, scatter_brush),
+                           datasets=names)
+
+    # level of detail: the cells are sized by their count of streams and the sampled points are only
+    # drawn inside the brush (an empty brush selects no point)
+    cell_chart = alt.Chart(cells).mark_square().encode(
+        x=x, y=y, color=genre_color,
+        size=alt.Size('count:Q', title="Streams", scale=alt.Scale(type='sqrt')),
+        tooltip=[alt.Tooltip('broad_genres:N', title="Genre"), alt.Tooltip('count:Q', title="Streams")]
+    ).transform_filter(
+        selection
+    ).add_selection(
+        selection,
+        scatter_brush
+    ).properties(
+        width=700, height=500
+    )
+    brushed_points = danceability_vs_hour.transform_filter(
+        "length(data('{0}_store')) && vlSelectionTest('{0}_store', datum)".format(scatter_brush.name)
+    )
+    return alt.vconcat(metric_danceability_vs_hour, cell_chart + brushed_points, datasets=names)
+
+
+def named_data(obj, datasets):
+    """Replaces the DataFrames in the chart object obj by NamedData of their object id, in place,
+    and adds them to datasets, with the DataFrames of the named datasets of the chart."""
+    if isinstance(obj, alt.SchemaBase):
+        for key, value in obj._kwds.items():
+            if key == "datasets" and isinstance(value, dict):
+                datasets.update(value)
+                obj._kwds[key] = alt.Undefined
+            elif isinstance(value, pd.DataFrame):
+                datasets[str(id(value))] = value
+                obj._kwds[key] = alt.NamedData(name=str(id(value)))
+            else:
+                named_data(value, datasets)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            named_data(value, datasets)
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            named_data(value, datasets)
+
+
+def chart_spec(chart):
+    """The Vega-Lite spec of chart as st.altair_chart makes it, to draw it with st.vega_lite_chart.
+
+    The data of the chart is left in the 'datasets' of the spec as DataFrames, named after
+    their object id, so Streamlit sends them as Arrow tables. Building the spec validates the
+    whole chart, which is most of the cost of drawing it, so the spec is worth keeping for as
+    long as the chart's data does not change.
+
+    The DataFrames are named in a copy of the chart rather than by a data transformer, since
+    the data transformers of altair are global and the sessions of the app build their specs
+    in several threads. The copy shares the DataFrames of the chart. As altair then has no
+    DataFrame to infer the types of the encoded fields from, they must all be given.
+    """
+    datasets = {}
+    chart = chart.copy(deep=True)
+    named_data(chart, datasets)
+    spec = chart.to_dict()
+    spec["datasets"] = datasets
+    return spec
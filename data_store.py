@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow.feather as feather
+
+# Bump this whenever the schemas below change so that old cache files are rebuilt
+schema_version = 2
+
+cache_dir_name = ".data_cache"
+
+audio_features = ["danceability", "energy", "key", "loudness", "mode", "speechiness", "acousticness",
+                  "instrumentalness", "liveness", "valence", "tempo", "duration_ms", "time_signature"]
+
+# The dtypes of each of the input tables, keyed by the table name without the data source suffix.
+# The timestamps in the csv files carry their utc offset, which changes with daylight saving
+# time, so they are parsed into utc and the offset of the local timestamps is kept in its own
+# column (in minutes) to recover the local wall clock time.
+schemas = {
+    "streaming_history": {
+        "utc_offsets": {"endTime_loc": "utc_offset_min"},
+        "datetimes": ["endTime_utc", "endTime_loc"],
+        "naive_datetimes": ["endTime"],
+        "categories": ["artistName", "trackName", "day_of_week", "season"],
+        "dtypes": {"msPlayed": "int32", "weekday": "int8", "season_num": "int8", "hour_of_day": "int8"},
+    },
+    "track_features": {
+        "categories": ["artistName", "trackName", "album", "album_type"],
+        "dtypes": dict({"n_listens": "int32", "popularity": "float32"}, **{f: "float32" for f in audio_features}),
+    },
+    "artists": {
+        "categories": ["artistName", "spotify_artist_name"],
+        "dtypes": {"n_listens": "int32", "popularity": "float32"},
+    },
+    "genres": {
+        "categories": ["artistName", "genre"],
+    },
+}
+
+
+def table_name(url):
+    """Returns the schema name of a data file, e.g. 'artists' for 'artists_public.csv'."""
+    stem = os.path.splitext(os.path.basename(url))[0]
+    for name in schemas:
+        if stem.startswith(name + "_") or stem == name:
+            return name
+    return None
+
+
+def apply_schema(df, name):
+    """Converts the columns of a freshly parsed csv table to the dtypes of its schema."""
+    schema = schemas.get(name, {})
+    df = df.copy()
+    for col, offset_col in schema.get("utc_offsets", {}).items():
+        if col in df:
+            df[offset_col] = parse_utc_offset(df[col])
+    for col in schema.get("datetimes", []):
+        if col in df:
+            df[col] = pd.to_datetime(df[col], utc=True)
+    for col in schema.get("naive_datetimes", []):
+        if col in df:
+            df[col] = pd.to_datetime(df[col])
+    for col in schema.get("categories", []):
+        if col in df:
+            df[col] = df[col].astype("category")
+    for col, dtype in schema.get("dtypes", {}).items():
+        # integer columns with missing values can not be downcast, leave them as they are
+        if col in df and not (dtype.startswith("int") and df[col].isna().any()):
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def parse_utc_offset(timestamps):
+    """Returns the utc offset in minutes of timestamp strings ending in '+HH:MM' or '-HH:MM'."""
+    parts = timestamps.astype(str).str.extract(r"([+-])(\d\d):?(\d\d)$")
+    sign = parts[0].map({"+": 1, "-": -1})
+    return (sign * (parts[1].astype(float) * 60 + parts[2].astype(float))).fillna(0).astype("int16")
+
+
+def file_hash(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def source_signature(path):
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def cache_paths(url, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(url)), cache_dir_name)
+    stem = os.path.splitext(os.path.basename(url))[0]
+    return os.path.join(cache_dir, stem + ".feather"), os.path.join(cache_dir, stem + ".json")
+
+
+def cache_is_valid(url, data_path, meta_path):
+    """Checks that the cached copy of url was built from its current contents.
+
+    The modification time and size are checked first. If they changed, the file is
+    hashed and the cache is still used (and its metadata refreshed) when the contents
+    are the same, e.g. after a fresh git checkout.
+    """
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("schema_version") != schema_version:
+        return False
+    signature = source_signature(url)
+    if signature["mtime_ns"] == meta.get("mtime_ns") and signature["size"] == meta.get("size"):
+        return True
+    if signature["size"] != meta.get("size") or file_hash(url) != meta.get("sha256"):
+        return False
+    meta.update(signature)
+    write_meta(meta_path, meta)
+    return True
+
+
+def write_atomically(path, write):
+    """Calls write(temporary path) and moves the file written there to path.
+
+    A reader never sees a partly written file, and an interrupted write leaves path as it was.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_meta(meta_path, meta):
+    def write(path):
+        with open(path, "w") as f:
+            json.dump(meta, f)
+    write_atomically(meta_path, write)
+
+
+def load_table(url, cache_dir=None):
+    """Loads one of the input csv tables with typed columns.
+
+    The first time a file is read it is parsed, converted to the dtypes of its schema
+    and written next to it as an uncompressed feather file. Later calls memory-map that
+    file instead of parsing the csv again, until the csv changes.
+    """
+    data_path, meta_path = cache_paths(url, cache_dir)
+    if cache_is_valid(url, data_path, meta_path):
+        return feather.read_table(data_path, memory_map=True).to_pandas()
+    df = apply_schema(pd.read_csv(url), table_name(url))
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    # the metadata is written last, a cache file is only used once its metadata matches the csv
+    write_atomically(data_path, lambda path: feather.write_feather(df.reset_index(drop=True), path,
+                                                                   compression="uncompressed"))
+    write_meta(meta_path, dict(source_signature(url), sha256=file_hash(url), schema_version=schema_version))
+    return df
+
+
+def clear_cache(url, cache_dir=None):
+    for path in cache_paths(url, cache_dir):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def data_source_urls(data_source):
+    return ["{}_{}.csv".format(name, data_source) for name in schemas]
+
+
+def load_report(data_source, repeats=5):
+    """Times a cold load (parsing the csv) against warm loads (reading the cache) of every
+    table of a data source and returns them as a DataFrame.
+    """
+    rows = []
+    for url in data_source_urls(data_source):
+        clear_cache(url)
+        start = time.perf_counter()
+        load_table(url)
+        cold = time.perf_counter() - start
+        warm = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            df = load_table(url)
+            warm.append(time.perf_counter() - start)
+        rows.append({"table": url, "rows": len(df), "cold_s": cold, "warm_s": min(warm),
+                     "speedup": cold / min(warm)})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    print(load_report(sys.argv[1] if len(sys.argv) > 1 else "public").to_string(index=False))
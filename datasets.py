@@ -0,0 +1,116 @@
+"""The data sources the app can show.
+
+A data source is a set of the four csv files written by the notebook or enrich.py,
+streaming_history_<name>.csv, track_features_<name>.csv, artists_<name>.csv and
+genres_<name>.csv, with the streaming history optionally in a streams_<name> store
+(see ingest.py). Uploaded files are saved in a directory of uploads named after the hash
+of their content.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from data_store import load_table, source_signature
+from ingest import StreamStore, manifest_name
+
+table_names = ["streaming_history", "track_features", "artists", "genres"]
+
+upload_dir = "uploads"
+
+valid_name = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class Dataset:
+    def __init__(self, name, directory="."):
+        if not valid_name.match(name):
+            raise ValueError("Invalid data source name: {!r}".format(name))
+        self.name = name
+        self.directory = directory
+        self.urls = {table: os.path.join(directory, "{}_{}.csv".format(table, name)) for table in table_names}
+        self.streams_store = os.path.join(directory, "streams_" + name)
+
+    def has_streams_store(self):
+        return os.path.exists(os.path.join(self.streams_store, manifest_name))
+
+    def exists(self):
+        tables = [t for t in table_names if t != "streaming_history" or not self.has_streams_store()]
+        return all(os.path.exists(self.urls[t]) for t in tables)
+
+    def source_files(self):
+        """The file each table is read from, the manifest of the store for a streams store."""
+        files = {t: url for t, url in self.urls.items() if os.path.exists(url)}
+        if self.has_streams_store():
+            files["streaming_history"] = os.path.join(self.streams_store, manifest_name)
+        return files
+
+    def signature(self):
+        """The modification time and size of every file of the data source."""
+        return {t: source_signature(path) for t, path in sorted(self.source_files().items())}
+
+    @property
+    def id(self):
+        """A key of the data source that changes when any of its files changes."""
+        signature = json.dumps([os.path.abspath(self.directory), self.name, self.signature()], sort_keys=True)
+        return "{}-{}".format(self.name, hashlib.sha1(signature.encode("utf-8")).hexdigest()[:12])
+
+    def load(self, table):
+        if table == "streaming_history" and self.has_streams_store():
+            return StreamStore(self.streams_store).load()
+        return load_table(self.urls[table])
+
+
+def data_sources(directory="."):
+    """The names of the complete data sources of directory."""
+    names = set()
+    for path in glob.glob(os.path.join(directory, "track_features_*.csv")):
+        names.add(os.path.basename(path)[len("track_features_"):-len(".csv")])
+    return sorted(name for name in names if valid_name.match(name) and Dataset(name, directory).exists())
+
+
+def find_dataset(name, directory="."):
+    """The Dataset of a data source name, a name of data_sources or of an upload."""
+    if name.startswith("upload-"):
+        return Dataset(name, os.path.join(upload_dir, name[len("upload-"):]))
+    return Dataset(name, directory)
+
+
+def save_upload(files, directory=upload_dir):
+    """Saves uploaded csv files and returns their Dataset, or None when a table is missing.
+
+    files is a list of (file name, content bytes), with one file whose name starts with
+    the name of each table, e.g. streaming_history_me.csv. The data source is named after
+    the hash of the content of the files, so the same upload is only saved once. The files
+    are written to a temporary directory that is renamed when they are complete, so other
+    sessions never read a partly saved upload.
+    """
+    contents = {}
+    for file_name, content in files:
+        for table in table_names:
+            if os.path.basename(file_name).startswith(table):
+                contents[table] = content
+    if set(contents) != set(table_names):
+        return None
+    digest = hashlib.sha256()
+    for table in table_names:
+        digest.update(hashlib.sha256(contents[table]).digest())
+    dataset = Dataset("upload-" + digest.hexdigest()[:16], os.path.join(directory, digest.hexdigest()[:16]))
+    if not dataset.exists():
+        os.makedirs(directory, exist_ok=True)
+        tmp_directory = tempfile.mkdtemp(dir=directory, prefix=".saving-")
+        try:
+            for table, content in contents.items():
+                with open(os.path.join(tmp_directory, os.path.basename(dataset.urls[table])), "wb") as f:
+                    f.write(content)
+            try:
+                os.replace(tmp_directory, dataset.directory)
+            except OSError:
+                # another session saved the same upload first
+                if not dataset.exists():
+                    raise
+        finally:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+    return dataset
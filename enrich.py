@@ -0,0 +1,338 @@
+import argparse
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+api_url = "https://api.spotify.com/v1"
+auth_url = "https://accounts.spotify.com/api/token"
+
+spotify_features = ["danceability", "energy", "key", "loudness", "mode", "speechiness", "acousticness",
+                    "instrumentalness", "liveness", "valence", "tempo", "duration_ms", "time_signature"]
+spotify_track_features = ["album", "album_release_date", "album_type", "explicit", "popularity", "preview_url", "artists"]
+
+# The largest number of ids accepted by the batch endpoints
+max_audio_features_ids = 100
+max_artists_ids = 50
+
+
+class DiskCache:
+    """A persistent key-value store of JSON values, shared by threads.
+
+    Every API response is stored as soon as it arrives, so an enrichment that is
+    interrupted only has to fetch what is missing when it is run again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+    def get_many(self, keys):
+        """The cached values of keys that are in the cache."""
+        found = {}
+        keys = list(keys)
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                query = "SELECT key, value FROM kv WHERE key IN ({})".format(",".join("?" * len(part)))
+                for key, value in self.db.execute(query, part):
+                    found[key] = json.loads(value)
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, items):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO kv VALUES (?, ?)",
+                                [(key, json.dumps(value)) for key, value in items.items()])
+            self.db.commit()
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+class RateLimiter:
+    """Spaces out the calls of all threads to at most rate per second."""
+
+    def __init__(self, rate):
+        self.interval = 1. / rate if rate else 0.
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Holds every thread back for seconds, e.g. after a 429 response."""
+        with self.lock:
+            self.next_time = max(self.next_time, time.monotonic() + seconds)
+
+
+class SpotifyClient:
+    """A thread-safe client for the Spotify Web API endpoints used by the enrichment.
+
+    Requests are spread over max_workers threads and limited to requests_per_second.
+    429 responses are retried after their Retry-After delay and server errors with an
+    exponential backoff. Every response is cached in cache (a DiskCache).
+    """
+
+    def __init__(self, client_id, client_secret, cache, api_url=api_url, auth_url=auth_url,
+                 max_workers=8, requests_per_second=10, max_retries=6, backoff=0.5):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.cache = cache
+        self.api_url = api_url.rstrip("/")
+        self.auth_url = auth_url
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(requests_per_second)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sessions = threading.local()
+        self.token_lock = threading.Lock()
+        self.token = None
+        self.token_expiry = 0.
+        self.count_lock = threading.Lock()
+        self.n_requests = 0
+
+    def session(self):
+        """A requests session per thread, sessions are not safe to share between threads."""
+        if not hasattr(self.sessions, "session"):
+            self.sessions.session = requests.Session()
+        return self.sessions.session
+
+    def access_token(self, refresh=False):
+        with self.token_lock:
+            if refresh or self.token is None or time.time() > self.token_expiry - 60:
+                credentials = base64.b64encode("{}:{}".format(self.client_id, self.client_secret).encode()).decode()
+                response = self.session().post(self.auth_url, data={"grant_type": "client_credentials"},
+                                             headers={"Authorization": "Basic " + credentials}, timeout=30)
+                response.raise_for_status()
+                body = response.json()
+                self.token = body["access_token"]
+                self.token_expiry = time.time() + body.get("expires_in", 3600)
+            return self.token
+
+    def get(self, path, params):
+        """GETs an API endpoint, retrying rate limited and failed requests."""
+        refresh = False
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            headers = {"Authorization": "Bearer " + self.access_token(refresh)}
+            refresh = False
+            with self.count_lock:
+                self.n_requests += 1
+            try:
+                response = self.session().get(self.api_url + path, params=params, headers=headers, timeout=30)
+            except requests.ConnectionError:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            if response.status_code == 429:
+                self.limiter.pause(float(response.headers.get("Retry-After", 1)))
+            elif response.status_code == 401:
+                refresh = True
+            elif response.status_code >= 500:
+                time.sleep(self.backoff * 2 ** attempt)
+            else:
+                response.raise_for_status()
+                return response.json()
+        response.raise_for_status()
+        raise requests.HTTPError("Gave up on {} after {} attempts".format(path, self.max_retries + 1))
+
+    def search(self, query, type):
+        """The first search result of type ('track' or 'artist') for query, or None."""
+        key = "search/{}/{}".format(type, query)
+        # searches without results are cached as None too
+        cached = self.cache.get_many([key])
+        if key in cached:
+            return cached[key]
+        items = self.get("/search", {"q": query, "type": type, "limit": 1})[type + "s"]["items"]
+        result = items[0] if items else None
+        self.cache.set(key, result)
+        return result
+
+    def batch(self, path, ids, batch_size, result_key):
+        """The objects of ids from a batch endpoint (e.g. /artists?ids=...), in a dict by id.
+
+        Only the ids that are not cached are requested, batch_size at a time, in parallel.
+        """
+        ids = list(dict.fromkeys(i for i in ids if i))
+        prefix = path.strip("/") + "/"
+        found = {key[len(prefix):]: value for key, value in self.cache.get_many(prefix + i for i in ids).items()}
+        missing = [i for i in ids if i not in found]
+
+        def fetch(batch_ids):
+            objects = self.get(path, {"ids": ",".join(batch_ids)})[result_key]
+            fetched = {i: obj for i, obj in zip(batch_ids, objects)}
+            self.cache.set_many({prefix + i: obj for i, obj in fetched.items()})
+            return fetched
+
+        batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for fetched in executor.map(fetch, batches):
+                found.update(fetched)
+        return found
+
+    def audio_features(self, ids):
+        return self.batch("/audio-features", ids, max_audio_features_ids, "audio_features")
+
+    def artists(self, ids):
+        return self.batch("/artists", ids, max_artists_ids, "artists")
+
+    def map(self, function, items):
+        """function applied to every item on the client's threads, in order."""
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            return list(executor.map(function, items))
+
+
+def remove_brackets(text):
+    """Removes the text inside parentheses/brackets."""
+    return re.sub(r"[\(\[].*?[\)\]]", "", text)
+
+
+def remove_special_characters(text):
+    return re.sub(r"[^A-Za-z0-9 ]+", "", text)
+
+
+def track_queries(artist_name, track_name):
+    """The searches tried in turn for a track, from the most to the least specific."""
+    return ["artist:" + artist_name + " track:" + track_name,
+            "artist:" + remove_brackets(artist_name) + " track:" + remove_brackets(track_name),
+            " track:" + remove_brackets(track_name),
+            "artist:" + remove_special_characters(artist_name) + " track:" + remove_special_characters(track_name)]
+
+
+def artist_queries(artist_name):
+    return ["artist:" + artist_name,
+            "artist:" + remove_brackets(artist_name),
+            "artist:" + remove_special_characters(artist_name)]
+
+
+def first_result(client, queries, type):
+    for query in queries:
+        result = client.search(query, type)
+        if result is not None:
+            return result
+    return None
+
+
+def enrich_tracks(client, tracks):
+    """Adds the Spotify id, audio features and album information of every track.
+
+    tracks has one row per (artistName, trackName) with its 'n_listens'. Returns the
+    table in the format of the track_features_*.csv files and the search result of each
+    track, which enrich_artists uses to find artist ids without searching.
+    """
+    def find(row):
+        artist_name, track_name = row
+        if artist_name == "Unknown Artist" or track_name == "Unknown Track":
+            return None
+        return first_result(client, track_queries(artist_name, track_name), "track")
+
+    results = client.map(find, list(zip(tracks["artistName"], tracks["trackName"])))
+    features = client.audio_features(r["id"] for r in results if r)
+
+    track_features = tracks.copy()
+    track_features["spotify_id"] = [r["id"] if r else None for r in results]
+    for feat in spotify_features:
+        track_features[feat] = [(features.get(r["id"]) or {}).get(feat, np.nan) if r else np.nan for r in results]
+    track_features["album"] = [r["album"]["name"] if r else None for r in results]
+    track_features["album_release_date"] = [r["album"]["release_date"] if r else None for r in results]
+    track_features["album_type"] = [r["album"]["album_type"] if r else None for r in results]
+    track_features["explicit"] = [r["explicit"] if r else None for r in results]
+    track_features["popularity"] = [r["popularity"] if r else None for r in results]
+    track_features["preview_url"] = [r["preview_url"] if r else None for r in results]
+    track_features["artists"] = [", ".join(a["name"] for a in r["artists"]) if r else None for r in results]
+    return track_features, results
+
+
+def enrich_artists(client, artists, track_results=()):
+    """Adds the Spotify id, genres, followers and popularity of every artist.
+
+    Artists that appear by name in the track search results are fetched by id in
+    batches, only the others are searched. Returns the table in the format of the
+    artists_*.csv files and the exploded (artistName, genre) table of genres_*.csv.
+    """
+    known_ids = {}
+    for result in track_results:
+        for artist in (result or {}).get("artists", []):
+            known_ids.setdefault(artist["name"].lower(), artist["id"])
+
+    names = list(artists["artistName"])
+    by_id = client.artists(known_ids[n.lower()] for n in names if n.lower() in known_ids)
+
+    def find(artist_name):
+        if artist_name == "Unknown Artist":
+            return None
+        artist_id = known_ids.get(artist_name.lower())
+        if artist_id in by_id and by_id[artist_id] is not None:
+            return by_id[artist_id]
+        return first_result(client, artist_queries(artist_name), "artist")
+
+    results = client.map(find, names)
+
+    artists = artists.copy()
+    artists["spotify_id"] = [r["id"] if r else None for r in results]
+    artists["genres"] = [str(r["genres"]) if r else None for r in results]
+    artists["spotify_artist_name"] = [r["name"] if r else None for r in results]
+    artists["n_followers"] = [r["followers"]["total"] if r else np.nan for r in results]
+    artists["popularity"] = [r["popularity"] if r else np.nan for r in results]
+    genres = pd.DataFrame([(name, genre) for name, r in zip(names, results) if r for genre in r["genres"]],
+                          columns=["artistName", "genre"])
+    return artists, genres
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gets the Spotify track features, artists and genres of a streaming history.")
+    parser.add_argument("streaming_history", help="streaming history csv, e.g. streaming_history_peter.csv")
+    parser.add_argument("--data-source", required=True, help="suffix of the output files, e.g. peter")
+    parser.add_argument("--cache", default="spotify_cache.sqlite", help="file of the response cache")
+    parser.add_argument("--api-url", default=api_url)
+    parser.add_argument("--auth-url", default=auth_url)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=10)
+    args = parser.parse_args()
+
+    client = SpotifyClient(os.environ["SPOTIFY_CLIENT_ID"], os.environ["SPOTIFY_CLIENT_SECRET"], DiskCache(args.cache),
+                           api_url=args.api_url, auth_url=args.auth_url, max_workers=args.workers,
+                           requests_per_second=args.requests_per_second)
+    sh = pd.read_csv(args.streaming_history)
+    start = time.perf_counter()
+    tracks = sh.groupby(["artistName", "trackName"]).size().reset_index(name="n_listens")
+    track_features, track_results = enrich_tracks(client, tracks)
+    track_features.to_csv("track_features_{}.csv".format(args.data_source), index=False)
+    artists = sh.groupby(["artistName"]).size().reset_index(name="n_listens")
+    artists, genres = enrich_artists(client, artists, track_results)
+    artists.to_csv("artists_{}.csv".format(args.data_source), index=False)
+    genres.to_csv("genres_{}.csv".format(args.data_source), index=False)
+    print("{} tracks and {} artists in {:.1f}s with {} requests".format(
+        len(track_features), len(artists), time.perf_counter() - start, client.n_requests))
+
+
+if __name__ == "__main__":
+    main()
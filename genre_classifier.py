@@ -0,0 +1,118 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# The broad genres are what will be used
+broad_genres = ["Classical", "Electronica", "Folk/Country", "Hip Hop", "Indie", "Jazz", "No Genre", "Other", "Pop",  "R&B", "Rap", "Rock", "Tie Genre"]
+# These are specific key words that differentiate the specific genres and allow us to categorizez them
+hip_hop_genres = ["hop", "boom bap", "funk", "urban contemporary", "lo-fi"]
+pop_genres = ["pop", "shibuya-kei", "new jack swing", "motown"]
+rap_genres = ["rap", "trap"]
+r_b_genres = ["r&b", "soul", "blues"]
+electronica_genres = ["electronica", "electro", "tronica", "techno", "electronic", "electric", "house", "step", "electra", "glitch", "vapor twitch", "chillwave", "edm"]
+rock_genres = ["rock", "metal", "grindcore"]
+jazz_genres = ["jazz", "bossa nova", "mpb"]
+classical_genres = ["classical", "baroque", "piano cover", "impressionism", "early music"]
+folk_country_genres = ["country", "folk"]
+indie_genres = ["indie"]
+
+# The order in which the keyword lists are checked. A specific genre belongs to the
+# first broad genre in this list that has a keyword contained in it, and to 'Other'
+# if none of them match
+genre_priority = [
+    ("Hip Hop", hip_hop_genres),
+    ("Pop", pop_genres),
+    ("Rap", rap_genres),
+    ("R&B", r_b_genres),
+    ("Electronica", electronica_genres),
+    ("Rock", rock_genres),
+    ("Jazz", jazz_genres),
+    ("Classical", classical_genres),
+    ("Indie", indie_genres),
+    ("Folk/Country", folk_country_genres),
+]
+
+
+class GenreClassifier:
+    """Maps specific Spotify genres (e.g. "thai indie rock") to broad genres.
+
+    All keyword lists are compiled once into a single regular expression. The
+    expression is a zero-width lookahead, so it reports a match at every position
+    of the string where any keyword starts, and its alternatives are ordered by
+    genre priority, so the first alternative matching at a position is the one
+    with the highest priority. Taking the highest priority over all positions gives
+    the same answer as checking each keyword list in turn with a substring test.
+    """
+
+    def __init__(self, priority=genre_priority):
+        self.priority = [name for name, _ in priority]
+        keyword_group = {}
+        alternatives = []
+        for group, (_, keywords) in enumerate(priority):
+            for keyword in keywords:
+                # a keyword listed under two broad genres belongs to the first one
+                if keyword not in keyword_group:
+                    keyword_group[keyword] = group
+                    alternatives.append(keyword)
+        self._keyword_group = keyword_group
+        self._pattern = re.compile("(?=(" + "|".join(re.escape(k) for k in alternatives) + "))")
+
+    def classify(self, specific_genre):
+        """Returns the broad genre of a single specific genre."""
+        groups = [self._keyword_group[m.group(1)] for m in self._pattern.finditer(specific_genre)]
+        if not groups:
+            return "Other"
+        return self.priority[min(groups)]
+
+    def classify_genres(self, specific_genres):
+        """Returns the broad genre of every entry of a series of specific genres.
+
+        Each distinct specific genre is matched only once.
+        """
+        specific_genres = pd.Series(specific_genres)
+        codes, uniques = pd.factorize(specific_genres)
+        broad = np.array([self.classify(g) for g in uniques], dtype=object)
+        return pd.Series(broad[codes], index=specific_genres.index, name="broad_genre")
+
+    def classify_artists(self, artists_df, genres_df):
+        """Returns a copy of artists_df with a 'broad_genres' column.
+
+        genres_df is the exploded artist genre table with one (artistName, genre)
+        row per specific genre of an artist. Each artist gets the broad genre that
+        the most of its specific genres map to, 'Tie Genre' when two or more broad
+        genres share the highest count, and 'No Genre' when Spotify did not provide
+        any genre for the artist.
+        """
+        genres = genres_df[["artistName", "genre"]].dropna()
+        genres = genres[genres["genre"] != ""]
+        counts = pd.crosstab(genres["artistName"], self.classify_genres(genres["genre"]).values)
+
+        artist_genre = pd.Series(dtype=object)
+        if not counts.empty:
+            values = counts.to_numpy()
+            max_counts = values.max(axis=1, keepdims=True)
+            is_tie = (values == max_counts).sum(axis=1) > 1
+            top_genre = counts.columns.to_numpy()[values.argmax(axis=1)]
+            artist_genre = pd.Series(np.where(is_tie, "Tie Genre", top_genre), index=counts.index)
+
+        artists_extra_df = artists_df.copy()
+        artists_extra_df["broad_genres"] = artists_extra_df["artistName"].astype(object).map(artist_genre).fillna("No Genre")
+        return artists_extra_df
+
+    def other_genres(self, genres_df):
+        """Returns the specific genres classified as 'Other', most frequent first.
+
+        Useful to find keywords that should be added to the keyword lists above.
+        """
+        genres = genres_df["genre"].dropna()
+        return genres[self.classify_genres(genres) == "Other"].value_counts()
+
+
+# compiled once per process
+default_classifier = GenreClassifier()
+
+
+def classify_artists(artists_df, genres_df):
+    """Categorizes the artists table into broad genres using the default keyword lists."""
+    return default_classifier.classify_artists(artists_df, genres_df)
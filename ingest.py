@@ -0,0 +1,276 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_store import file_hash, schemas, source_signature, write_atomically
+
+# The columns that identify a stream. Spotify exports overlap when they are requested
+# more than once, so a stream with the same values for all of them is only kept once.
+stream_key = ["endTime", "artistName", "trackName", "msPlayed"]
+
+seasons = np.array(["winter", "spring", "summer", "fall"])
+
+manifest_name = "manifest.json"
+
+
+def iter_json_records(path, chunk_size=50000, block_size=1 << 20):
+    """Yields the objects of a JSON array file in lists of at most chunk_size.
+
+    The file is read block by block and decoded one object at a time, so memory does
+    not grow with the size of the export.
+    """
+    decoder = json.JSONDecoder()
+    chunk = []
+    buffer = ""
+    position = 0
+    started = False
+    with open(path, encoding="utf-8") as f:
+        while True:
+            block = f.read(block_size)
+            buffer = buffer[position:] + block
+            position = 0
+            while True:
+                # skip the whitespace, the opening bracket and the commas between objects
+                while position < len(buffer) and buffer[position] in " \t\r\n,[]":
+                    started = started or buffer[position] == "["
+                    position += 1
+                if position >= len(buffer):
+                    break
+                if not started:
+                    raise ValueError("{} is not a JSON array".format(path))
+                try:
+                    record, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # the object continues in the next block
+                    if not block:
+                        raise
+                    break
+                chunk.append(record)
+                position = end
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if not block:
+                break
+    if chunk:
+        yield chunk
+
+
+def stream_hashes(chunk):
+    """A 64 bit hash of the stream_key columns of every row."""
+    return pd.util.hash_pandas_object(chunk[stream_key], index=False).to_numpy()
+
+
+def derive_columns(chunk, timezone):
+    """Adds the columns of the streaming history csv files, computed from 'endTime' (utc).
+
+    'endTime_loc' is kept in utc like the other timestamps of data_store, and the offset of
+    the local time in minutes is stored in 'utc_offset_min'.
+    """
+    end_time = pd.to_datetime(chunk["endTime"])
+    utc = end_time.dt.tz_localize("UTC")
+    local = utc.dt.tz_convert(timezone)
+    local_wall_clock = local.dt.tz_localize(None)
+    season_num = (local.dt.month % 12 + 3) // 3
+    return pd.DataFrame({
+        "endTime": end_time,
+        "artistName": chunk["artistName"].astype(str),
+        "trackName": chunk["trackName"].astype(str),
+        "msPlayed": chunk["msPlayed"].astype("int32"),
+        "endTime_utc": utc,
+        "endTime_loc": utc,
+        "day_of_week": local.dt.day_name(),
+        "weekday": (local.dt.dayofweek // 5 == 1).astype("int8"),
+        "season_num": season_num.astype("int8"),
+        "season": seasons[season_num.to_numpy() - 1],
+        "hour_of_day": local.dt.hour.astype("int8"),
+        "utc_offset_min": ((local_wall_clock - end_time).dt.total_seconds() // 60).astype("int16"),
+        "month": local_wall_clock.dt.strftime("%Y-%m"),
+    })
+
+
+def empty_streams(timezone):
+    """A table without rows with the columns and dtypes of the parts of a StreamStore."""
+    chunk = pd.DataFrame({"endTime": pd.Series(dtype="datetime64[ns]"), "artistName": pd.Series(dtype=object),
+                          "trackName": pd.Series(dtype=object), "msPlayed": pd.Series(dtype="int32")})
+    return derive_columns(chunk, timezone).drop(columns="month")
+
+
+class StreamStore:
+    """An append-only store of deduplicated streams, partitioned by local month.
+
+    Layout of the store directory:
+
+    - month=YYYY-MM/part-BBBBB-CCCCC.parquet: the streams added by chunk CCCCC of
+      ingestion batch BBBBB (one batch per export file)
+    - hashes/part-BBBBB-CCCCC.npy: the sorted hashes of the streams of the same chunk
+    - manifest.json: the export files already ingested and the last batch number
+
+    The streams of a chunk are written under temporary .tmp names and only renamed once the
+    hashes of the chunk are written, so an ingestion that is interrupted can be run again
+    without storing any stream twice.
+    """
+
+    def __init__(self, path, timezone="UTC"):
+        self.path = path
+        self.timezone = timezone
+        self.manifest_path = os.path.join(path, manifest_name)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"timezone": timezone, "batches": 0, "files": {}}
+        self._hashes = None
+
+    def known_hashes(self):
+        """The sorted hash arrays of the previous batches, memory-mapped."""
+        if self._hashes is None:
+            self._hashes = [np.load(p, mmap_mode="r") for p in sorted(glob.glob(os.path.join(self.path, "hashes", "*.npy")))]
+        return self._hashes
+
+    def recover(self):
+        """Finishes the chunks of an interrupted ingestion.
+
+        The parts of a chunk whose hashes were written are renamed to their final names, the
+        others are removed, their streams are added again by the next ingestion.
+        """
+        for tmp_path in glob.glob(os.path.join(self.path, "month=*", "*.parquet.tmp")):
+            part = os.path.basename(tmp_path)[:-len(".parquet.tmp")]
+            if os.path.exists(os.path.join(self.path, "hashes", part + ".npy")):
+                os.replace(tmp_path, tmp_path[:-len(".tmp")])
+            else:
+                os.remove(tmp_path)
+
+    def is_new(self, hashes):
+        new = np.ones(len(hashes), dtype=bool)
+        for known in self.known_hashes():
+            if len(known):
+                positions = np.minimum(np.searchsorted(known, hashes), len(known) - 1)
+                new &= known[positions] != hashes
+        return new
+
+    def is_ingested(self, path):
+        entry = self.manifest["files"].get(os.path.abspath(path))
+        return entry is not None and {k: entry[k] for k in ("mtime_ns", "size")} == source_signature(path)
+
+    def ingest_file(self, path, chunk_size=50000):
+        """Appends the streams of one export file that are not in the store yet.
+
+        Returns the number of streams added. Files that were already ingested and did not
+        change since are skipped.
+        """
+        if self.is_ingested(path):
+            return 0
+        self.recover()
+        batch = self.manifest["batches"] + 1
+        # claim the batch number first so an interrupted batch's files are never overwritten
+        self.manifest["batches"] = batch
+        self.write_manifest()
+        added = 0
+        batch_hashes = []
+        for records in iter_json_records(path, chunk_size):
+            chunk = pd.DataFrame.from_records(records)
+            hashes = stream_hashes(chunk)
+            # drop the streams already stored and the repeats inside the chunk itself
+            _, first = np.unique(hashes, return_index=True)
+            keep = np.zeros(len(chunk), dtype=bool)
+            keep[first] = True
+            keep &= self.is_new(hashes)
+            for seen in batch_hashes:
+                keep &= ~np.isin(hashes, seen)
+            if not keep.any():
+                continue
+            rows = derive_columns(chunk[keep].reset_index(drop=True), self.manifest["timezone"])
+            name = "part-{:05d}-{:05d}".format(batch, len(batch_hashes))
+            tmp_paths = []
+            for month, part in rows.groupby("month", sort=False):
+                directory = os.path.join(self.path, "month=" + month)
+                os.makedirs(directory, exist_ok=True)
+                tmp_paths.append(os.path.join(directory, name + ".parquet.tmp"))
+                pq.write_table(pa.Table.from_pandas(part.drop(columns="month"), preserve_index=False), tmp_paths[-1])
+            # the hash file is the commit point of the chunk, the parts are renamed after it
+            os.makedirs(os.path.join(self.path, "hashes"), exist_ok=True)
+            hash_path = os.path.join(self.path, "hashes", name + ".npy")
+            with open(hash_path + ".tmp", "wb") as f:
+                np.save(f, np.sort(hashes[keep]))
+            os.replace(hash_path + ".tmp", hash_path)
+            for tmp_path in tmp_paths:
+                os.replace(tmp_path, tmp_path[:-len(".tmp")])
+            batch_hashes.append(np.sort(hashes[keep]))
+            added += int(keep.sum())
+
+        self._hashes = None
+        self.manifest["files"][os.path.abspath(path)] = dict(source_signature(path), sha256=file_hash(path), streams_added=added)
+        self.write_manifest()
+        return added
+
+    def write_manifest(self):
+        """Replaces the manifest atomically, an interrupted write leaves the previous one."""
+        def write(path):
+            with open(path, "w") as f:
+                json.dump(self.manifest, f, indent=1)
+        os.makedirs(self.path, exist_ok=True)
+        write_atomically(self.manifest_path, write)
+
+    def ingest(self, paths, chunk_size=50000):
+        """Ingests every export file of paths, returns the number of streams added per file."""
+        return {path: self.ingest_file(path, chunk_size) for path in paths}
+
+    def load(self, months=None, after_batch=None):
+        """The stored streams with the dtypes of data_store's streaming history schema.
+
+        months optionally restricts the partitions read, e.g. ['2020-01', '2020-02'], and
+        after_batch the batches read to those ingested after that batch number.
+        """
+        files = sorted(glob.glob(os.path.join(self.path, "month=*", "*.parquet")))
+        if months is not None:
+            files = [f for f in files if os.path.basename(os.path.dirname(f))[len("month="):] in months]
+        if after_batch is not None:
+            files = [f for f in files if int(os.path.basename(f).split("-")[1]) > after_batch]
+        if files:
+            df = pa.concat_tables([pq.read_table(f) for f in files]).to_pandas()
+            df = df.sort_values("endTime", kind="stable").reset_index(drop=True)
+        else:
+            df = empty_streams(self.manifest["timezone"])
+        for col in schemas["streaming_history"]["categories"]:
+            df[col] = df[col].astype("category")
+        return df
+
+    def to_csv(self, path):
+        """Writes the stored streams in the format of the streaming_history_*.csv files."""
+        df = self.load()
+        offsets = df.pop("utc_offset_min").astype(int)
+        local = df["endTime_loc"].dt.tz_localize(None) + pd.to_timedelta(offsets, unit="min")
+        sign = pd.Series(np.where(offsets < 0, "-", "+"), index=df.index)
+        df["endTime_loc"] = (local.dt.strftime("%Y-%m-%d %H:%M:%S") + sign
+                             + (offsets.abs() // 60).map("{:02d}".format) + ":" + (offsets.abs() % 60).map("{:02d}".format))
+        df.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adds Spotify StreamingHistory*.json exports to a stream store.")
+    parser.add_argument("files", nargs="+", help="StreamingHistory*.json export files")
+    parser.add_argument("--store", required=True, help="directory of the stream store, e.g. streams_public")
+    parser.add_argument("--timezone", default="UTC", help="timezone of the listener, used when the store is created")
+    parser.add_argument("--csv", help="also write the whole store to this streaming history csv file")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    store = StreamStore(args.store, args.timezone)
+    for path in args.files:
+        start = time.perf_counter()
+        added = store.ingest_file(path, args.chunk_size)
+        print("{}: {} new streams ({:.2f}s)".format(path, added, time.perf_counter() - start))
+    if args.csv:
+        store.to_csv(args.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Named timing spans for the stages of the app.
+
+A Recorder collects one entry per span with its wall time, memory delta, rows and,
+for the st.cache functions, whether the cache was hit. The entries are shown in the
+sidebar "Performance" panel and logged as JSON lines on the 'spotify_vizzz.perf' logger:
+
+    recorder = activate(Recorder(enabled=True))
+    with recorder.span("load_data:artists", cached=True) as span:
+        artists_df = load_data(artists_url)   # calls cache_miss() when its body runs
+        span.rows = len(artists_df)
+
+When a recorder is disabled its spans are a shared object that does nothing.
+"""
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+logger = logging.getLogger("spotify_vizzz.perf")
+
+
+def current_rss_mb():
+    """The resident memory of the process in megabytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # without /proc, fall back on the peak resident memory, ru_maxrss is in
+        # kilobytes on Linux and in bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def log_to_stderr(level=logging.INFO):
+    """Prints the span log lines, e.g. when the app runs with SPOTIFY_VIZZZ_PERF_LOG=1."""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+def log_enabled():
+    return logger.isEnabledFor(logging.INFO)
+
+
+class Span:
+    def __init__(self, recorder, name, rows=None, cached=False):
+        self.recorder = recorder
+        self.name = name
+        self.rows = rows
+        self.cached = cached
+        self.missed = False
+
+    def __enter__(self):
+        # the entry keeps its place in the order the spans start, a parent before its children
+        self.index = len(self.recorder.entries)
+        self.recorder.entries.append(None)
+        self.recorder.stack.append(self)
+        self.rss_before = current_rss_mb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        rss = current_rss_mb()
+        self.recorder.stack.pop()
+        self.recorder.record(self.index, {
+            "run": self.recorder.run_id,
+            "span": self.name,
+            "depth": len(self.recorder.stack),
+            "seconds": round(seconds, 6),
+            "cache": ("miss" if self.missed else "hit") if self.cached else None,
+            "rows": self.rows,
+            "rss_mb": round(rss, 1),
+            "rss_delta_mb": round(rss - self.rss_before, 1),
+        })
+        return False
+
+
+class NullSpan:
+    """The span of a disabled recorder."""
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+null_span = NullSpan()
+
+
+class Recorder:
+    """The spans of one run of the script."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.run_id = uuid.uuid4().hex[:8]
+        self.entries = []
+        self.stack = []
+
+    def span(self, name, rows=None, cached=False):
+        """A context manager timing the code it wraps, set its rows attribute to record rows."""
+        if not self.enabled:
+            return null_span
+        return Span(self, name, rows, cached)
+
+    def record(self, index, entry):
+        self.entries[index] = entry
+        if log_enabled():
+            logger.info(json.dumps(entry))
+
+    def frame(self):
+        """The entries as a table, nested spans indented under their parent."""
+        entries = [e for e in self.entries if e is not None]
+        df = pd.DataFrame(entries, columns=["span", "depth", "seconds", "cache", "rows", "rss_delta_mb", "rss_mb"])
+        df["span"] = [". " * d + s for s, d in zip(df["span"], df["depth"])]
+        return df.drop(columns="depth")
+
+
+# The active recorder is an attribute of the thread of the script run. st.cache hashes the
+# functions and module globals that a cached function uses, so cache_miss must not reach a
+# global that changes between runs or that it cannot hash.
+def activate(recorder):
+    """Makes recorder the one that cache_miss() and span() report to in this thread."""
+    threading.current_thread().perf_recorder = recorder
+    return recorder
+
+
+def current():
+    return getattr(threading.current_thread(), "perf_recorder", None)
+
+
+def span(name, rows=None, cached=False):
+    """A span of the active recorder, for code that does not hold the recorder."""
+    recorder = current()
+    return recorder.span(name, rows, cached) if recorder is not None else null_span
+
+
+def cache_miss():
+    """Called in the body of a cached function, marks the enclosing cached span as a miss."""
+    recorder = current()
+    if recorder is not None:
+        for s in reversed(recorder.stack):
+            if s.cached:
+                s.missed = True
+                break
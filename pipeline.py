@@ -0,0 +1,212 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def time_features(end_time, utc_offset_min=None):
+    """Derives the time of day and week columns used by the charts from one timestamp column.
+
+    The timestamps are parsed (or converted) to utc a single time and shifted by
+    utc_offset_min, the offset in minutes of the listener's local time (utc when it is
+    not given). Every feature is computed from that local wall clock time:
+
+    - 'date': the local date, as a timestamp at midnight
+    - 'hour' and 'minute_of_day': the hour and the minute of the day
+    - 'hour_of_day': the minute of the day as a fraction of an hour, counted down from
+      24 so that the morning is at the top of the violin plot
+    - 'iso_year', 'iso_week' and 'week_key' (iso_year * 100 + iso_week): the ISO week of
+      the timestamp, used to count how many weeks the dataset spans
+    """
+    local_time = pd.to_datetime(end_time, utc=True).dt.tz_localize(None)
+    if utc_offset_min is not None:
+        local_time = local_time + pd.to_timedelta(np.asarray(utc_offset_min, dtype=np.int64), unit="min")
+    hour = local_time.dt.hour.to_numpy(dtype=np.int16)
+    minute_of_day = hour * 60 + local_time.dt.minute.to_numpy(dtype=np.int16)
+    iso = local_time.dt.isocalendar()
+    iso_year = iso["year"].to_numpy(dtype=np.int32)
+    iso_week = iso["week"].to_numpy(dtype=np.int8)
+    return pd.DataFrame({
+        "date": local_time.dt.normalize(),
+        "hour": hour.astype(np.int8),
+        "minute_of_day": minute_of_day,
+        "hour_of_day": 24 - minute_of_day / 60.,
+        "iso_year": iso_year,
+        "iso_week": iso_week,
+        "week_key": iso_year * 100 + iso_week,
+    }, index=end_time.index)
+
+
+def add_time_features(df, column="endTime_loc", offset_column="utc_offset_min"):
+    """Returns df with the columns of time_features(df[column]), replacing any existing ones.
+
+    The columns of df are not copied: the result is a shallow copy that shares them and
+    only owns the new columns.
+    """
+    features = time_features(df[column], df[offset_column] if offset_column in df else None)
+    df = df.copy(deep=False)
+    for col in features:
+        df[col] = features[col].to_numpy()
+    return df
+
+
+def count_weeks(df):
+    """The number of distinct ISO weeks with at least one stream in df."""
+    return int(df["week_key"].nunique())
+
+
+def shared_dictionary(*columns):
+    """The sorted union of the distinct values of several (categorical or object) columns."""
+    dictionary = pd.Index([])
+    for column in columns:
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            values = column.cat.categories
+        else:
+            values = pd.Index(column.dropna().unique())
+        dictionary = dictionary.union(values)
+    return dictionary
+
+
+def encode(column, dictionary):
+    """The position of every value of column in dictionary, -1 for missing values.
+
+    For categorical columns only the categories are looked up and the codes are remapped.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        positions = dictionary.get_indexer(column.cat.categories)
+        codes = column.cat.codes.to_numpy()
+        return np.where(codes >= 0, positions[codes], -1).astype(np.int64)
+    return dictionary.get_indexer(column).astype(np.int64)
+
+
+def lookup(keys, table_keys):
+    """The row of table_keys holding each of keys, -1 when there is none or the key is -1."""
+    valid = np.flatnonzero(table_keys >= 0)
+    positions = pd.Index(table_keys[valid]).get_indexer(keys)
+    return np.where(positions >= 0, valid[positions], -1)
+
+
+def take_column(column, rows):
+    """column[rows] as a compact column: text columns become categoricals, so each distinct
+    value is stored once however many streams repeat it.
+    """
+    if column.dtype == object:
+        codes, uniques = pd.factorize(column)
+        return pd.Categorical.from_codes(codes[rows], uniques)
+    if isinstance(column.dtype, np.dtype):
+        return column.to_numpy()[rows]
+    # categoricals, timezone aware timestamps and other extension arrays
+    return column.array.take(rows)
+
+
+def indexed_merge(sh, tracks, artists, suffixes=(("_strm_hist", "_track"), ("_track", "_artist"))):
+    """Inner joins the streaming history with the track features and the artists.
+
+    Gives the same rows and columns as merging on ['trackName', 'artistName'] and then on
+    ['artistName'], with the rows in the order of sh, but the names are only compared once: the
+    three tables are given dense integer keys from a shared dictionary of artist names
+    ('artist_id') and of (artist, track) pairs, and the join is a take of the matching
+    track ('track_id') and artist rows. The name columns of the result are categoricals
+    over the shared dictionaries. Returns None when the track or artist keys are not
+    unique, in which case a hash join is needed.
+    """
+    artist_names = shared_dictionary(sh["artistName"], tracks["artistName"], artists["artistName"])
+    track_names = shared_dictionary(sh["trackName"], tracks["trackName"])
+
+    def pair_keys(df):
+        artist_id = encode(df["artistName"], artist_names)
+        track_name_id = encode(df["trackName"], track_names)
+        keys = artist_id * len(track_names) + track_name_id
+        keys[(artist_id < 0) | (track_name_id < 0)] = -1
+        return artist_id, keys
+
+    sh_artist_id, sh_keys = pair_keys(sh)
+    _, track_keys = pair_keys(tracks)
+    artist_ids = encode(artists["artistName"], artist_names)
+    if not (pd.Index(track_keys[track_keys >= 0]).is_unique and pd.Index(artist_ids[artist_ids >= 0]).is_unique):
+        return None
+
+    track_row = lookup(sh_keys, track_keys)
+    artist_row = lookup(sh_artist_id, artist_ids)
+    rows = np.flatnonzero((track_row >= 0) & (artist_row >= 0))
+    track_row, artist_row = track_row[rows], artist_row[rows]
+
+    key_columns = {
+        "artistName": pd.Categorical.from_codes(sh_artist_id[rows], artist_names),
+        "trackName": pd.Categorical.from_codes(sh_keys[rows] % len(track_names), track_names),
+    }
+    columns = {}
+    for col in sh:
+        columns[col] = key_columns[col] if col in key_columns else take_column(sh[col], rows)
+
+    # the remaining columns of each table, with the suffixes of DataFrame.merge for the
+    # column names the tables have in common
+    for table, table_rows, on, (left_suffix, right_suffix) in [
+            (tracks, track_row, ["trackName", "artistName"], suffixes[0]),
+            (artists, artist_row, ["artistName"], suffixes[1])]:
+        for col in table:
+            if col in on:
+                continue
+            if col in columns:
+                columns = {(name + left_suffix if name == col else name): values for name, values in columns.items()}
+                columns[col + right_suffix] = take_column(table[col], table_rows)
+            else:
+                columns[col] = take_column(table[col], table_rows)
+
+    columns["artist_id"] = sh_artist_id[rows].astype(np.int32)
+    columns["track_id"] = track_row.astype(np.int32)
+    return pd.DataFrame(columns)
+
+
+def merge_tables(sh, tracks, artists):
+    """Joins the streaming history, track features and artists tables, see indexed_merge."""
+    df = indexed_merge(sh, tracks, artists)
+    if df is None:
+        df = sh.merge(tracks, on=["trackName", "artistName"], suffixes=["_strm_hist", "_track"])
+        df = df.merge(artists, on=["artistName"], suffixes=["_track", "_artist"])
+    return df
+
+
+def concat_categorical(*columns):
+    """Concatenates columns, categoricals over the sorted union of their categories."""
+    if len(columns) > 1 and all(isinstance(column.dtype, pd.CategoricalDtype) for column in columns):
+        categories = columns[0].cat.categories
+        for column in columns[1:]:
+            categories = categories.union(column.cat.categories)
+        columns = [column.cat.set_categories(categories) for column in columns]
+    return pd.concat(columns, ignore_index=True)
+
+
+def concat_streams(parts):
+    """Concatenates tables of streams with the same columns, e.g. the parts of the streams of
+    a precompute bundle, with the categoricals of concat_categorical."""
+    if len(parts) == 1:
+        return parts[0]
+    return pd.DataFrame({col: concat_categorical(*[part[col] for part in parts]) for col in parts[0]})
+
+
+def merge_report(sh, tracks, artists):
+    """Compares the time and memory of the string key merge with indexed_merge."""
+    rows = []
+    for name, merge in [("string keys", lambda: sh.merge(tracks, on=["trackName", "artistName"], suffixes=["_strm_hist", "_track"])
+                                             .merge(artists, on=["artistName"], suffixes=["_track", "_artist"])),
+                        ("integer keys", lambda: indexed_merge(sh, tracks, artists))]:
+        start = time.perf_counter()
+        df = merge()
+        seconds = time.perf_counter() - start
+        rows.append({"merge": name, "rows": len(df), "seconds": seconds,
+                     "memory_mb": df.memory_usage(deep=True).sum() / 2 ** 20})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    from data_store import load_table
+    from genre_classifier import classify_artists
+
+    data_source = sys.argv[1] if len(sys.argv) > 1 else "public"
+    sh = load_table("streaming_history_{}.csv".format(data_source))
+    tracks = load_table("track_features_{}.csv".format(data_source))
+    artists = classify_artists(load_table("artists_{}.csv".format(data_source)),
+                               load_table("genres_{}.csv".format(data_source)))
+    print(merge_report(sh, tracks, artists).to_string(index=False))
@@ -0,0 +1,645 @@
+"""Builds every artifact of the dashboard for a data source ahead of time.
+
+    python precompute.py public
+
+writes a bundle in bundles/<data source>/ next to the data files: the classified artists,
+the streams with their time columns and the track features they are merged with
+('merge_data:' artifacts, see read_merged) and the tables of every chart, as uncompressed
+feather files, and a manifest.json with the sha256 of each of them, of the input files
+and of the code that computed them. The app loads the artifacts of a fresh bundle instead
+of computing them, except for the merged data itself: its streams are joined with the track
+features and artists again each time it is loaded (see read_merged), which the app only
+does for the "Show Merged Data" table. A bundle goes stale when an input file or the code changes, and is
+then ignored until it is built again.
+
+When streams were only appended to the streaming history since the bundle was built, none
+of them before its watermark (the last 'endTime_utc' it holds), the bundle is updated
+instead: only the new streams are parsed, given their time columns and merged, they are
+stored as a new part of the streams, and their counts are added to the chart tables and to
+the sums kept in its 'state:' artifacts. Only the
+artists that are new or whose genres changed are classified. The result is the same as
+building the bundle again, which --full forces.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from chart_data import (add_genre_hour_played, add_genre_minute_counts, add_heat_map_cubes, add_metric_cells,
+                        add_metric_points, add_metric_sample, duration_cutoff_cube, duration_cutoff_table,
+                        genre_hour_density, genre_hour_minutes, genre_hour_played, genre_minute_counts, heat_map_cube,
+                        metric_cells, metric_max_points, metric_points, metric_sample, metric_track_names,
+                        music_metrics, played_minutes_per_week, sample_track_names, violin_bandwidths)
+from data_store import apply_schema, file_hash, schema_version, source_signature
+from datasets import find_dataset, table_names
+from genre_classifier import classify_artists
+from ingest import StreamStore
+from pipeline import add_time_features, concat_streams, count_weeks, merge_tables
+
+# Bump this whenever the layout of the bundles changes
+bundle_version = 3
+
+bundle_dir_name = "bundles"
+
+# The modules whose code computes the artifacts, a change to any of them makes the bundles stale
+code_modules = ["data_store.py", "ingest.py", "datasets.py", "genre_classifier.py", "pipeline.py", "chart_data.py",
+                "precompute.py"]
+
+
+def code_hash():
+    sha = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in code_modules:
+        sha.update(module.encode("utf-8"))
+        sha.update(file_hash(os.path.join(directory, module)).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def bundle_path(dataset):
+    return os.path.join(dataset.directory, bundle_dir_name, dataset.name)
+
+
+def artifact_file(name, params=()):
+    """The file name of an artifact, e.g. 'chart_data-metric-energy.feather'."""
+    return "-".join([name.replace(":", "-")] + [str(p) for p in params]) + ".feather"
+
+
+def write_artifact(df, directory, name, params=()):
+    """Writes a DataFrame artifact and returns its manifest entry."""
+    path = os.path.join(directory, artifact_file(name, params))
+    feather.write_feather(df.reset_index(drop=True), path, compression="uncompressed")
+    return {"file": os.path.basename(path), "rows": len(df), "sha256": file_hash(path)}
+
+
+# The chart tables, computed from the merged data. The metric artifacts are built for every
+# music metric, and the cells and sampled points of the scatter plot only when it has more than
+# metric_max_points.
+def played_vs_duration_table(df):
+    return duration_cutoff_table(duration_cutoff_cube(df))
+
+
+def streamgraph_table(df):
+    return genre_hour_minutes(df, count_weeks(df))
+
+
+chart_artifacts = {
+    "chart_data:played_vs_duration": played_vs_duration_table,
+    "chart_data:heat_map_cube": heat_map_cube,
+    "chart_data:streamgraph": streamgraph_table,
+}
+
+
+def violin_tables(minute_counts):
+    """The densities of the violin plot for every bandwidth choice, by bandwidth."""
+    return {bandwidth: genre_hour_density(minute_counts, bandwidth) for bandwidth in violin_bandwidths}
+
+
+# The sums of the streams kept to update the charts whose tables are not sums themselves
+def week_keys_table(df):
+    return pd.DataFrame({"week_key": np.unique(df["week_key"].to_numpy())})
+
+
+state_artifacts = {
+    "state:genre_hour_played": genre_hour_played,
+    "state:genre_minute_counts": genre_minute_counts,
+    "state:week_keys": week_keys_table,
+}
+
+
+def track_chart_columns(tracks):
+    """The columns of the track features the charts use, by artist and track name."""
+    columns = tracks[["artistName", "trackName", "duration_ms"] + music_metrics]
+    return columns.astype({"artistName": object, "trackName": object})
+
+
+def artist_genre_hashes(genres):
+    """A hash of the genres of every artist, that changes when any of its genres changes."""
+    genres = genres[["artistName", "genre"]].astype(object)
+    hashes = pd.Series(pd.util.hash_pandas_object(genres, index=False).to_numpy(), index=genres["artistName"].to_numpy())
+    return hashes.groupby(level=0).sum().rename_axis("artistName").reset_index(name="genres_hash")
+
+
+def metric_tables(df, metric):
+    """The artifacts of the music metric charts of metric, by name."""
+    points = metric_points(df, metric)
+    return dict(points_tables(points, metric_track_names(df, points), metric))
+
+
+def points_tables(points, names, metric):
+    """The (name, table) of the metric artifacts of points and the names of their tracks."""
+    yield "chart_data:metric", points
+    yield "chart_data:metric_track_names", names
+    if len(points) > metric_max_points:
+        yield "chart_data:metric_cells", metric_cells(points, metric)
+        sample = metric_sample(points, names, metric_max_points)
+        yield "chart_data:metric_sample", sample
+        yield "chart_data:metric_sample_track_names", sample_track_names(names, sample)
+
+
+def read_artifact(directory, name, params=()):
+    return feather.read_table(os.path.join(directory, artifact_file(name, params)), memory_map=True).to_pandas()
+
+
+def stream_part(number):
+    """The param of the artifact of a part of the streams of a bundle, e.g. '00002'."""
+    return "{:05d}".format(number)
+
+
+def read_merged(directory, n_parts):
+    """The merged data of a bundle, its parts of streams joined with its tables."""
+    streams = concat_streams([read_artifact(directory, "merge_data:streams", (stream_part(i),)) for i in range(n_parts)])
+    return merge_tables(streams, read_artifact(directory, "merge_data:track_features"),
+                        read_artifact(directory, "classify_artist_genres"))
+
+
+def build_chart_artifact(directory, name):
+    """Process pool task: builds one chart or state artifact from the merged data of the bundle."""
+    df = read_artifact(directory, "merge_data")
+    build = chart_artifacts.get(name) or state_artifacts[name]
+    return {name: write_artifact(build(df), directory, name)}
+
+
+def build_violin_artifacts(directory):
+    """Process pool task: builds the violin plot artifacts of every bandwidth."""
+    df = read_artifact(directory, "merge_data")
+    return {"chart_data:violin/{}".format(bandwidth): write_artifact(table, directory, "chart_data:violin", (bandwidth,))
+            for bandwidth, table in violin_tables(genre_minute_counts(df)).items()}
+
+
+def build_metric_artifacts(directory, metric):
+    """Process pool task: builds the artifacts of one music metric."""
+    df = read_artifact(directory, "merge_data")
+    return {"{}/{}".format(name, metric): write_artifact(table, directory, name, (metric,))
+            for name, table in metric_tables(df, metric).items()}
+
+
+def load_input(dataset, table):
+    """Process pool task: loads a csv table once so that its typed copy is in the data cache."""
+    return len(dataset.load(table))
+
+
+def input_entries(dataset, hashes=None):
+    """The manifest entries of the input files, hashes optionally gives the sha256 of some tables."""
+    hashes = hashes or {}
+    return {table: dict(source_signature(path), sha256=hashes.get(table) or file_hash(path))
+            for table, path in dataset.source_files().items()}
+
+
+def stream_batches(dataset):
+    """The number of batches of the streams store of dataset, None when it has none."""
+    return StreamStore(dataset.streams_store).manifest["batches"] if dataset.has_streams_store() else None
+
+
+def increment_entry(sh, streams, merged, parts, batches):
+    """The manifest entry of the streams a bundle holds, from which it can be updated.
+
+    streams is the number of streams of the bundle, merged the number of rows of its merged
+    data and parts the number of parts its streams are stored in.
+    """
+    watermark = sh["endTime_utc"].max() if len(sh) else None
+    return {"watermark": None if watermark is None or pd.isna(watermark) else watermark.isoformat(),
+            "streams": streams, "merged": merged, "stream_parts": parts, "stream_batches": batches,
+            "stream_columns": list(sh.columns)}
+
+
+def write_bundle(path, building, manifest):
+    """Writes the manifest of the bundle built in building and puts it in place of the one at path."""
+    with open(os.path.join(building, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+    old = path + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(building, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def precompute(dataset, workers=None):
+    """Builds the bundle of dataset and returns its manifest.
+
+    The tables are loaded and the chart artifacts built in a pool of worker processes,
+    the chart workers memory-map the merged data written by the main process, which is
+    removed once they are done: the bundle only keeps the streams and tables it is merged
+    from. The bundle is built in a temporary directory that replaces the previous bundle
+    when it is done, and is removed when the build fails.
+    """
+    start = time.perf_counter()
+    path = bundle_path(dataset)
+    building = path + ".building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    try:
+        manifest = {"bundle_version": bundle_version, "schema_version": schema_version, "code_sha256": code_hash(),
+                    "data_source": dataset.name, "inputs": input_entries(dataset), "artifacts": {}}
+        artifacts = manifest["artifacts"]
+        timings = {}
+
+        with ProcessPoolExecutor(workers) as pool:
+            stage = time.perf_counter()
+            batches = stream_batches(dataset)
+            # the csv tables are parsed in parallel into the data cache that the main process then
+            # memory-maps, a streams store has no such cache and is only read by the main process
+            cached = [table for table in table_names if table != "streaming_history" or batches is None]
+            list(pool.map(load_input, [dataset] * len(cached), cached))
+            tables = {table: dataset.load(table) for table in table_names}
+            sh = tables["streaming_history"]
+            timings["load_tables"] = time.perf_counter() - stage
+
+            stage = time.perf_counter()
+            artists = classify_artists(tables["artists"], tables["genres"])
+            artifacts["classify_artist_genres"] = write_artifact(artists, building, "classify_artist_genres")
+            artifacts["state:artist_genres"] = write_artifact(artist_genre_hashes(tables["genres"]), building,
+                                                              "state:artist_genres")
+            artifacts["state:tracks"] = write_artifact(track_chart_columns(tables["track_features"]), building,
+                                                       "state:tracks")
+            timings["classify_artist_genres"] = time.perf_counter() - stage
+
+            # the merged data is stored as the streams with their time columns and the tables they
+            # are joined with, update appends the streams added since as new parts
+            stage = time.perf_counter()
+            streams = add_time_features(sh)
+            merged = merge_tables(streams, tables["track_features"], artists)
+            artifacts["merge_data:streams/" + stream_part(0)] = write_artifact(streams, building, "merge_data:streams",
+                                                                               (stream_part(0),))
+            artifacts["merge_data:track_features"] = write_artifact(tables["track_features"], building,
+                                                                    "merge_data:track_features")
+            feather.write_feather(merged, os.path.join(building, artifact_file("merge_data")), compression="uncompressed")
+            manifest["increment"] = increment_entry(sh, len(sh), len(merged), 1, batches)
+            timings["merge_data"] = time.perf_counter() - stage
+            del streams, merged, tables, sh
+
+            stage = time.perf_counter()
+            futures = [pool.submit(build_chart_artifact, building, name) for name in list(chart_artifacts) + list(state_artifacts)]
+            futures.append(pool.submit(build_violin_artifacts, building))
+            futures += [pool.submit(build_metric_artifacts, building, metric) for metric in music_metrics]
+            for future in futures:
+                artifacts.update(future.result())
+            os.remove(os.path.join(building, artifact_file("merge_data")))
+            timings["chart_data"] = time.perf_counter() - stage
+
+        manifest["seconds"] = dict(timings, total=time.perf_counter() - start)
+        write_bundle(path, building, manifest)
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+    return manifest
+
+
+def hash_prefix(f, size, chunk_size=1 << 20):
+    """The sha256 object of the next size bytes of the file f, and the last of those bytes."""
+    sha = hashlib.sha256()
+    last = b""
+    while size > 0:
+        chunk = f.read(min(chunk_size, size))
+        if not chunk:
+            break
+        sha.update(chunk)
+        last = chunk[-1:]
+        size -= len(chunk)
+    return sha, last
+
+
+def appended_streams(dataset, manifest):
+    """The streams appended to the streaming history of dataset since its bundle was built.
+
+    Only the new rows of a csv file are parsed, after checking that the rows before them
+    are the ones the bundle was built from, and only the new batches of a streams store
+    are read. Returns the streams and the sha256 of the csv file (None for a store), which
+    is hashed in the same pass, or None when the streaming history did not only grow.
+    """
+    increment = manifest["increment"]
+    batches = stream_batches(dataset)
+    if batches is not None:
+        if increment["stream_batches"] is None or batches < increment["stream_batches"]:
+            return None
+        return StreamStore(dataset.streams_store).load(after_batch=increment["stream_batches"]), None
+    if increment["stream_batches"] is not None:
+        return None
+    path = dataset.urls["streaming_history"]
+    entry = manifest["inputs"]["streaming_history"]
+    if os.path.getsize(path) < entry["size"]:
+        return None
+    with open(path, "rb") as f:
+        header = f.readline()
+        f.seek(0)
+        sha, last = hash_prefix(f, entry["size"])
+        if sha.hexdigest() != entry["sha256"] or last != b"\n":
+            return None
+        tail = f.read()
+    sha.update(tail)
+    return apply_schema(pd.read_csv(io.BytesIO(header + tail)), "streaming_history"), sha.hexdigest()
+
+
+def track_rows(old_tracks, tracks):
+    """The row of the current track features of each track of old_tracks, -1 when it changed.
+
+    old_tracks is the track_chart_columns of the track features a bundle was built from,
+    its rows are the 'track_id' of the bundle. A track changed when it is missing or when
+    one of the columns the charts use changed.
+    """
+    keys = pd.MultiIndex.from_arrays([tracks["artistName"].astype(object), tracks["trackName"].astype(object)])
+    if not keys.is_unique:
+        return np.full(len(old_tracks), -1)
+    rows = keys.get_indexer(pd.MultiIndex.from_arrays([old_tracks["artistName"], old_tracks["trackName"]]))
+    found = rows >= 0
+    for col in old_tracks.columns.drop(["artistName", "trackName"]):
+        old, new = old_tracks[col].to_numpy()[found], tracks[col].to_numpy()[rows[found]]
+        found[found] = (old == new) | (np.isnan(old) & np.isnan(new))
+    return np.where(found, rows, -1)
+
+
+def classify_appended(classified, genre_hashes, artists, genres):
+    """classify_artists(artists, genres) reusing classified, the artists of an earlier classification.
+
+    genre_hashes is the artist_genre_hashes of the genres of that classification. Only the
+    artists that are new or whose genres changed are classified. Returns the classified
+    artists and the number of artists of the earlier classification whose broad genre changed.
+    """
+    names = artists["artistName"].astype(object)
+    previous = classified.drop_duplicates("artistName")
+    previous = pd.Series(previous["broad_genres"].to_numpy(), index=previous["artistName"].astype(object).to_numpy())
+    old_hashes = genre_hashes.set_index("artistName")["genres_hash"].reindex(names, fill_value=0).to_numpy()
+    new_hashes = artist_genre_hashes(genres).set_index("artistName")["genres_hash"].reindex(names, fill_value=0).to_numpy()
+    known = names.isin(previous.index).to_numpy()
+    reuse = known & (old_hashes == new_hashes)
+
+    broad_genres = np.empty(len(artists), dtype=object)
+    broad_genres[reuse] = previous.reindex(names[reuse]).to_numpy()
+    changed = 0
+    if not reuse.all():
+        unseen = names[~reuse]
+        broad_genres[~reuse] = classify_artists(artists[~reuse], genres[genres["artistName"].astype(object).isin(unseen)])[
+            "broad_genres"].to_numpy()
+        reclassified = known[~reuse]
+        changed = int((previous.reindex(unseen[reclassified]).to_numpy() != broad_genres[~reuse][reclassified]).sum())
+    artists = artists.copy()
+    artists["broad_genres"] = broad_genres
+    return artists, changed
+
+
+def link_artifact(path, building, entry):
+    """Puts the file of an artifact of the bundle at path in building without copying it."""
+    source, target = os.path.join(path, entry["file"]), os.path.join(building, entry["file"])
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def update(dataset):
+    """Updates the bundle of dataset with the streams appended to its streaming history.
+
+    The cost of an update grows with the number of appended streams and the size of the
+    tables, not with the streams the bundle already holds: the new streams are merged on
+    their own and stored as a new part of the streams, the earlier parts are linked into the
+    updated bundle as they are, and the chart tables are updated with the counts of the new
+    streams only.
+
+    Returns the manifest of the updated bundle and None, or None and the reason why the
+    bundle has to be built from scratch: the code or format changed, streams were not only
+    appended after the watermark, some streams of the bundle had no track or artist, or the
+    track features or broad genre of tracks and artists of the bundle changed.
+    """
+    start = time.perf_counter()
+    path = bundle_path(dataset)
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None, "no bundle"
+    reasons = stale_reasons(dataset, manifest, compare_inputs=False)
+    if reasons:
+        return None, ", ".join(reasons)
+    increment = manifest["increment"]
+    if increment["merged"] != increment["streams"]:
+        # the streams without a track or artist could be merged with the current tables
+        return None, "streams without track features"
+    bundle = Bundle(path, manifest)
+    timings = {}
+
+    stage = time.perf_counter()
+    batches = stream_batches(dataset)
+    appended = appended_streams(dataset, manifest)
+    if appended is None:
+        return None, "streams changed"
+    sh, streams_sha256 = appended
+    if len(sh) == 0:
+        # the columns and dtypes of the streams of the bundle, without its rows
+        sh = feather.read_table(os.path.join(path, artifact_file("merge_data:streams", (stream_part(0),))),
+                                columns=increment["stream_columns"], memory_map=True).slice(0, 0).to_pandas()
+    if list(sh.columns) != increment["stream_columns"]:
+        return None, "streaming history columns"
+    if len(sh) and increment["watermark"] is not None and not (sh["endTime_utc"] >= pd.Timestamp(increment["watermark"])).all():
+        return None, "streams before the watermark"
+    tables = {table: dataset.load(table) for table in ["track_features", "artists", "genres"]}
+    timings["load_tables"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    track_ids = track_rows(bundle.load("state:tracks"), tables["track_features"])
+    if (track_ids < 0).any():
+        return None, "track features changed"
+    artists, changed = classify_appended(bundle.load("classify_artist_genres"), bundle.load("state:artist_genres"),
+                                         tables["artists"], tables["genres"])
+    if changed:
+        return None, "broad genres changed"
+    timings["classify_artist_genres"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    streams = add_time_features(sh)
+    delta = merge_tables(streams, tables["track_features"], artists)
+    if "track_id" not in delta:
+        return None, "duplicate tracks"
+    timings["merge_data"] = time.perf_counter() - stage
+
+    building = path + ".building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    try:
+        n_parts = increment["stream_parts"] + (1 if len(sh) else 0)
+        manifest = dict(manifest, inputs=input_entries(dataset, {"streaming_history": streams_sha256}), artifacts={},
+                        increment=increment_entry(sh, increment["streams"] + len(sh), increment["merged"] + len(delta),
+                                                  n_parts, batches))
+        if len(sh) == 0:
+            manifest["increment"]["watermark"] = increment["watermark"]
+        artifacts = manifest["artifacts"]
+
+        def write(name, df, params=()):
+            artifacts["/".join([name] + [str(p) for p in params])] = write_artifact(df, building, name, params)
+
+        stage = time.perf_counter()
+        for number in range(increment["stream_parts"]):
+            key = "merge_data:streams/" + stream_part(number)
+            link_artifact(path, building, bundle.manifest["artifacts"][key])
+            artifacts[key] = bundle.manifest["artifacts"][key]
+        if len(sh):
+            write("merge_data:streams", streams, (stream_part(increment["stream_parts"]),))
+        write("merge_data:track_features", tables["track_features"])
+        write("classify_artist_genres", artists)
+        write("state:artist_genres", artist_genre_hashes(tables["genres"]))
+        write("state:tracks", track_chart_columns(tables["track_features"]))
+        timings["write_merge_data"] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        cutoff_table = bundle.load("chart_data:played_vs_duration")
+        delta_table = played_vs_duration_table(delta)
+        write("chart_data:played_vs_duration", cutoff_table.assign(n_less=cutoff_table["n_less"] + delta_table["n_less"],
+                                                                   n_more=cutoff_table["n_more"] + delta_table["n_more"]))
+        write("chart_data:heat_map_cube", add_heat_map_cubes(bundle.load("chart_data:heat_map_cube"), heat_map_cube(delta)))
+        played = add_genre_hour_played(bundle.load("state:genre_hour_played"), genre_hour_played(delta))
+        week_keys = pd.DataFrame({"week_key": np.union1d(bundle.load("state:week_keys")["week_key"], delta["week_key"])})
+        write("state:genre_hour_played", played)
+        write("state:week_keys", week_keys)
+        write("chart_data:streamgraph", played_minutes_per_week(played, len(week_keys)))
+        counts = add_genre_minute_counts(bundle.load("state:genre_minute_counts"), genre_minute_counts(delta))
+        write("state:genre_minute_counts", counts)
+        for bandwidth, table in violin_tables(counts).items():
+            write("chart_data:violin", table, (bandwidth,))
+
+        # the track ids are rows of the track features, the old points get the rows of their tracks
+        # in the current ones, then only the points of the new streams are looked up and added
+        for metric in music_metrics:
+            points = bundle.load("chart_data:metric", (metric,))
+            names = bundle.load("chart_data:metric_track_names", (metric,))
+            points["track_id"] = track_ids[points["track_id"].to_numpy()].astype(np.int32)
+            names["track_id"] = track_ids[names["track_id"].to_numpy()].astype(np.int32)
+            delta_points = metric_points(delta, metric)
+            n_points = len(points)
+            points = add_metric_points(points, delta_points)
+            names = pd.concat([names, metric_track_names(delta, delta_points)], ignore_index=True).drop_duplicates("track_id")
+            write("chart_data:metric", points, (metric,))
+            write("chart_data:metric_track_names", names, (metric,))
+            if len(points) <= metric_max_points:
+                continue
+            if bundle.has("chart_data:metric_cells", (metric,)):
+                cells = add_metric_cells(bundle.load("chart_data:metric_cells", (metric,)),
+                                         metric_cells(delta_points, metric), metric)
+                sample = bundle.load("chart_data:metric_sample", (metric,))
+                sample["track_id"] = track_ids[sample["track_id"].to_numpy()].astype(np.int32)
+                sample = add_metric_sample(sample, delta_points, points.iloc[n_points:], names, metric_max_points)
+            else:
+                cells = metric_cells(points, metric)
+                sample = metric_sample(points, names, metric_max_points)
+            write("chart_data:metric_cells", cells, (metric,))
+            write("chart_data:metric_sample", sample, (metric,))
+            write("chart_data:metric_sample_track_names", sample_track_names(names, sample), (metric,))
+        timings["chart_data"] = time.perf_counter() - stage
+
+        manifest["seconds"] = dict(timings, total=time.perf_counter() - start)
+        manifest["appended_streams"] = len(sh)
+        write_bundle(path, building, manifest)
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+    return manifest, None
+
+
+class Bundle:
+    """The artifacts of a bundle written by precompute."""
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+
+    def has(self, name, params=()):
+        if name == "merge_data":
+            return "merge_data:streams/" + stream_part(0) in self.manifest["artifacts"]
+        return "/".join([name] + [str(p) for p in params]) in self.manifest["artifacts"]
+
+    def load(self, name, params=()):
+        if name == "merge_data":
+            return read_merged(self.path, self.manifest["increment"]["stream_parts"])
+        entry = self.manifest["artifacts"]["/".join([name] + [str(p) for p in params])]
+        return feather.read_table(os.path.join(self.path, entry["file"]), memory_map=True).to_pandas()
+
+    def verify(self):
+        """The names of the artifacts whose file does not match its sha256 anymore."""
+        return [name for name, entry in self.manifest["artifacts"].items()
+                if file_hash(os.path.join(self.path, entry["file"])) != entry["sha256"]]
+
+
+def manifest_signature(dataset):
+    """The signature of the manifest of the bundle of dataset, None when there is no bundle."""
+    path = os.path.join(bundle_path(dataset), "manifest.json")
+    return source_signature(path) if os.path.exists(path) else None
+
+
+def stale_reasons(dataset, manifest, compare_inputs=True):
+    """Why a bundle manifest does not match the dataset and code anymore, empty when it is fresh.
+
+    Like the data cache, the inputs are compared on their modification time and size first
+    and only hashed when those changed. With compare_inputs False, only the code, format and
+    the set of input files are compared.
+    """
+    reasons = []
+    if manifest.get("bundle_version") != bundle_version or manifest.get("schema_version") != schema_version:
+        reasons.append("bundle format")
+    if manifest.get("code_sha256") != code_hash():
+        reasons.append("code")
+    files = dataset.source_files()
+    if set(files) != set(manifest["inputs"]):
+        reasons.append("tables")
+    for table, path in files.items():
+        entry = manifest["inputs"].get(table)
+        if entry is None or not compare_inputs:
+            continue
+        signature = source_signature(path)
+        if signature != {k: entry[k] for k in ("mtime_ns", "size")} and (
+                signature["size"] != entry["size"] or file_hash(path) != entry["sha256"]):
+            reasons.append(table)
+    return reasons
+
+
+def open_bundle(dataset):
+    """The fresh bundle of dataset, or None when it has none or it is stale."""
+    path = bundle_path(dataset)
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if stale_reasons(dataset, manifest):
+        return None
+    return Bundle(path, manifest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precomputes the dashboard artifacts of data sources. The merged data "
+                                                 "is stored as the streams and the tables they are joined with, and is "
+                                                 "joined again each time it is loaded.")
+    parser.add_argument("data_sources", nargs="+", help="data source names, e.g. public")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: the number of cpus)")
+    parser.add_argument("--check", action="store_true", help="only report whether the bundles are fresh")
+    parser.add_argument("--full", action="store_true", help="build the bundles from scratch instead of updating them")
+    args = parser.parse_args()
+
+    for name in args.data_sources:
+        dataset = find_dataset(name)
+        if args.check:
+            try:
+                with open(os.path.join(bundle_path(dataset), "manifest.json")) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                print("{}: no bundle".format(name))
+                continue
+            reasons = stale_reasons(dataset, manifest)
+            corrupt = Bundle(bundle_path(dataset), manifest).verify()
+            print("{}: {}".format(name, "stale ({})".format(", ".join(reasons + corrupt)) if reasons or corrupt else "fresh"))
+            continue
+        manifest, reason = update(dataset) if not args.full else (None, "--full")
+        if manifest is not None:
+            print("{}: updated with {} appended streams".format(name, manifest["appended_streams"]))
+        else:
+            print("{}: full build ({})".format(name, reason))
+            manifest = precompute(dataset, args.workers)
+        print("{}: {} artifacts in {}".format(name, len(manifest["artifacts"]), bundle_path(dataset)))
+        print(pd.Series(manifest["seconds"]).round(3).to_string())
+
+
+if __name__ == "__main__":
+    main()
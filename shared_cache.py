@@ -0,0 +1,126 @@
+"""A process-wide cache of the processed artifacts of every dataset served by the app.
+
+Entries are evicted least recently used first when their total size goes over a memory
+budget. When several sessions ask for an artifact that is not built yet, the first one
+builds it and the others wait for its result instead of building it again.
+"""
+import collections
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+def nbytes(value):
+    """The memory used by an artifact, DataFrames and arrays included."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(nbytes(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class Building:
+    """An artifact being built by another session."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.interrupted = False
+
+
+class SharedCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # key -> (value, size), least recently used first
+        self.building = {}
+        self.total_bytes = 0
+        self.counts = collections.Counter()
+
+    def get(self, key, build):
+        """The artifact of key, build() is called when no session built it yet."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counts["hits"] += 1
+                return self.entries[key][0]
+            pending = self.building.get(key)
+            if pending is None:
+                pending = self.building[key] = Building()
+                self.counts["misses"] += 1
+                owner = True
+            else:
+                self.counts["waits"] += 1
+                owner = False
+
+        if not owner:
+            pending.done.wait()
+            if pending.interrupted:
+                # the session that was building it stopped, this one builds it instead
+                return self.get(key, build)
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            value = build()
+        except Exception as e:
+            pending.error = e
+            raise
+        except BaseException:
+            # Streamlit stops and reruns scripts with exceptions that are not Exceptions, the
+            # sessions waiting for the artifact must not get them
+            pending.interrupted = True
+            raise
+        else:
+            pending.value = value
+            self.add(key, value)
+        finally:
+            with self.lock:
+                del self.building[key]
+            pending.done.set()
+        return value
+
+    def add(self, key, value):
+        size = nbytes(value)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            # the new entry is kept even when it is larger than the budget on its own
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.counts["evictions"] += 1
+
+    def clear(self, dataset_id=None):
+        """Drops every entry, or the entries whose key starts with dataset_id."""
+        with self.lock:
+            for key in list(self.entries):
+                if dataset_id is None or key[0] == dataset_id:
+                    self.total_bytes -= self.entries.pop(key)[1]
+
+    def metrics(self):
+        with self.lock:
+            requests = self.counts["hits"] + self.counts["waits"] + self.counts["misses"]
+            return {
+                "hits": self.counts["hits"],
+                "waits": self.counts["waits"],
+                "misses": self.counts["misses"],
+                "evictions": self.counts["evictions"],
+                "hit_rate": (self.counts["hits"] + self.counts["waits"]) / requests if requests else None,
+                "entries": len(self.entries),
+                "datasets": len({key[0] for key in self.entries}),
+                "used_mb": self.total_bytes / 2 ** 20,
+                "budget_mb": self.max_bytes / 2 ** 20,
+            }
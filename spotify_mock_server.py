@@ -0,0 +1,208 @@
+"""A local stand-in for the Spotify endpoints used by enrich.py.
+
+It answers the client credentials token request, /v1/search, /v1/audio-features and
+/v1/artists with deterministic fake objects derived from the query or the ids, so the
+throughput, rate limit handling and resume behavior of the enrichment can be measured
+offline. Run it with `python spotify_mock_server.py` or use it from Python:
+
+    with MockSpotifyServer(rate_limit=20) as server:
+        client = SpotifyClient("id", "secret", DiskCache(path), api_url=server.api_url,
+                               auth_url=server.auth_url)
+        ...
+        server.request_counts["/v1/search"]
+"""
+import argparse
+import collections
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+genre_words = ["indie", "pop", "rock", "hip hop", "jazz", "classical", "house", "folk", "r&b", "trap", "lo-fi", "metal"]
+
+
+def fake_id(text):
+    """A stable 22 character id, like Spotify's base62 ids."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:22]
+
+
+def number(text, low, high):
+    """A stable pseudo random number in [low, high) for text."""
+    value = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16) / 16 ** 8
+    return low + value * (high - low)
+
+
+def parse_query(query):
+    fields = dict(re.findall(r"(artist|track):((?:(?!\s(?:artist|track):).)*)", query))
+    return fields.get("artist", "").strip(), fields.get("track", "").strip()
+
+
+def fake_artist(artist_id, name):
+    genres = [genre_words[int(number(name + str(i), 0, len(genre_words)))] for i in range(int(number(name, 0, 4)))]
+    return {"id": artist_id, "name": name, "genres": sorted(set(genres)), "type": "artist",
+            "followers": {"total": int(number(name, 0, 1e6))}, "popularity": int(number(name, 0, 100))}
+
+
+def fake_track(artist_name, track_name):
+    track_id = fake_id("track:" + artist_name + "/" + track_name)
+    return {"id": track_id, "name": track_name, "type": "track", "explicit": number(track_id, 0, 1) < 0.2,
+            "popularity": int(number(track_id, 0, 100)), "preview_url": None,
+            "artists": [{"id": fake_id("artist:" + artist_name), "name": artist_name}],
+            "album": {"name": track_name + " - Single", "album_type": "single",
+                      "release_date": "20{:02d}-01-01".format(int(number(track_id, 0, 21)))}}
+
+
+def fake_audio_features(track_id):
+    features = {f: number(track_id + f, 0, 1) for f in
+                ["danceability", "energy", "speechiness", "acousticness", "instrumentalness", "liveness", "valence"]}
+    features.update({"id": track_id, "key": int(number(track_id + "key", 0, 12)), "mode": int(number(track_id + "mode", 0, 2)),
+                     "loudness": number(track_id + "loudness", -30, 0), "tempo": number(track_id + "tempo", 60, 180),
+                     "duration_ms": int(number(track_id + "duration", 90000, 360000)), "time_signature": 4})
+    return features
+
+
+class MockSpotifyServer:
+    """Serves the fake API on a background thread.
+
+    - rate_limit: requests per second accepted before answering 429 with a Retry-After
+      header (None for no limit)
+    - latency: seconds added to every response
+    - not_found: a regular expression; searches matching it return no result, like
+      Spotify does for queries with extra text in brackets
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, rate_limit=None, latency=0., retry_after=1,
+                 not_found=r"[\(\[]"):
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.retry_after = retry_after
+        self.not_found = re.compile(not_found) if not_found else None
+        self.request_counts = collections.Counter()
+        self.n_rate_limited = 0
+        self.lock = threading.Lock()
+        self.window = collections.deque()
+        self.artist_names = {}
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    @property
+    def api_url(self):
+        return self.url + "/v1"
+
+    @property
+    def auth_url(self):
+        return self.url + "/api/token"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def rate_limited(self):
+        """Records a request and tells whether it goes over the rate limit of the last second."""
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self.window and self.window[0] < now - 1:
+                self.window.popleft()
+            if len(self.window) >= self.rate_limit:
+                self.n_rate_limited += 1
+                return True
+            self.window.append(now)
+            return False
+
+    def respond(self, method, path, query):
+        """Returns (status, headers, body) for a request."""
+        with self.lock:
+            self.request_counts[path] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method == "POST" and path == "/api/token":
+            return 200, {}, {"access_token": "mock-token", "token_type": "Bearer", "expires_in": 3600}
+        if self.rate_limited():
+            return 429, {"Retry-After": str(self.retry_after)}, {"error": {"status": 429, "message": "API rate limit exceeded"}}
+        params = {k: v[0] for k, v in parse_qs(query).items()}
+        if path == "/v1/search":
+            q, type = params.get("q", ""), params.get("type", "track")
+            artist_name, track_name = parse_query(q)
+            items = []
+            if not (self.not_found and self.not_found.search(q)) and (artist_name or track_name):
+                if type == "track":
+                    items = [fake_track(artist_name or "Various Artists", track_name)]
+                else:
+                    items = [fake_artist(fake_id("artist:" + artist_name), artist_name)]
+            return 200, {}, {type + "s": {"items": items}}
+        if path in ("/v1/audio-features", "/v1/artists"):
+            ids = [i for i in params.get("ids", "").split(",") if i]
+            limit = 100 if path == "/v1/audio-features" else 50
+            if len(ids) > limit:
+                return 400, {}, {"error": {"status": 400, "message": "Too many ids requested"}}
+            if path == "/v1/audio-features":
+                return 200, {}, {"audio_features": [fake_audio_features(i) for i in ids]}
+            # the mock only knows the names of the artists it returned in track results
+            return 200, {}, {"artists": [fake_artist(i, self.artist_names.get(i, i)) for i in ids]}
+        return 404, {}, {"error": {"status": 404, "message": "Not found"}}
+
+    def handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self, method):
+                parsed = urlparse(self.path)
+                if method == "POST":
+                    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, headers, body = mock.respond(method, parsed.path, parsed.query)
+                if parsed.path == "/v1/search" and status == 200:
+                    for item in body.get("tracks", {}).get("items", []):
+                        for artist in item["artists"]:
+                            mock.artist_names[artist["id"]] = artist["name"]
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a local stand-in for the Spotify API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second before answering 429")
+    parser.add_argument("--latency", type=float, default=0.)
+    args = parser.parse_args()
+    server = MockSpotifyServer(port=args.port, rate_limit=args.rate_limit, latency=args.latency)
+    print("Serving on {} (token url {})".format(server.api_url, server.auth_url))
+    server.server.serve_forever()
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from chart_data import chart_payload_bytes, duration_cutoff_cube, duration_cutoff_table
+from charts import chart_spec, genre_time_charts, heat_map_chart, metric_charts, played_vs_duration_chart
+
+
+def genre_tables(seed):
+    rng = np.random.default_rng(seed)
+    genres = ["rock", "pop", "jazz"]
+    minutes = pd.DataFrame({"hour": np.repeat(np.arange(24), 3), "broad_genres": genres * 24,
+                            "averageMinutesPlayed": rng.random(72)})
+    density = pd.DataFrame({"hour_of_day": np.tile(np.linspace(0, 24, 10), 3),
+                            "broad_genres": np.repeat(genres, 10), "density": rng.random(30)})
+    return minutes, density
+
+
+def test_chart_specs_built_in_threads_keep_their_own_data():
+    tables = [genre_tables(seed) for seed in range(16)]
+    active = alt.data_transformers.active
+    with ThreadPoolExecutor(8) as pool:
+        specs = list(pool.map(lambda t: chart_spec(genre_time_charts(*t)), tables))
+    assert alt.data_transformers.active == active
+    for (minutes, density), spec in zip(tables, specs):
+        assert sorted(map(id, spec["datasets"].values())) == sorted([id(minutes), id(density)])
+
+
+def test_chart_spec_is_not_limited_to_max_rows():
+    dates = pd.Timestamp("2021-01-04") + pd.to_timedelta(np.arange(6000), unit="h")
+    counts = pd.DataFrame({"date": dates.normalize(), "day_of_week": dates.day_name(), "hour": dates.hour,
+                           "count": np.ones(6000, dtype=int)})
+    spec = chart_spec(heat_map_chart(counts))
+    assert [len(df) for df in spec["datasets"].values()] == [6000]
+    assert chart_payload_bytes(spec) > 6000 * len('{"day_of_week": "Monday"}')
+
+
+def test_heat_map_bins_dates_in_utc():
+    dates = pd.to_datetime(["2021-01-04", "2021-01-05"])
+    counts = pd.DataFrame({"date": dates, "day_of_week": dates.day_name(), "hour": [0, 23], "count": [1, 2]})
+    spec = chart_spec(heat_map_chart(counts))
+    date_encodings = [view["encoding"]["x"] for view in spec["vconcat"] if view["encoding"]["x"]["field"] == "date"]
+    assert date_encodings
+    assert all(x["timeUnit"] == "utcyearmonthdate" for x in date_encodings)
+
+
+def test_played_vs_duration_chart_draws_the_rows_of_the_app_cutoff():
+    streams = pd.DataFrame({"msPlayed": [5000, 15000, 25000, 200000], "duration_ms": [200000] * 4})
+    table = duration_cutoff_table(duration_cutoff_cube(streams))
+    spec = chart_spec(played_vs_duration_chart(table, 20.))
+    # the cutoff is only set by the slider of the app, the chart has no control of its own
+    assert "selection" not in spec and "params" not in spec
+    (rows,) = spec["datasets"].values()
+    assert len(rows) == len(table) / table["cutoff_index"].nunique()
+    assert rows["n_less"].sum() == 2 and rows["n_more"].sum() == 2
+
+
+def test_metric_chart_looks_the_track_names_up_in_its_datasets():
+    points = pd.DataFrame({"minute_of_day": [60, 600], "energy": [0.2, 0.8], "broad_genres": ["Rock", "Pop"],
+                           "track_id": [0, 1], "count": [3, 1]})
+    track_names = pd.DataFrame({"track_id": [0, 1], "artistName": ["A", "B"], "trackName": ["x", "y"]})
+    debug_mode = alt.utils.schemapi.DEBUG_MODE
+    spec = chart_spec(metric_charts(points, track_names, "energy"))
+    assert alt.utils.schemapi.DEBUG_MODE == debug_mode
+    lookups = [t for view in spec["vconcat"] for t in view.get("transform", []) if "lookup" in t]
+    assert [spec["datasets"][t["from"]["data"]["name"]] is track_names for t in lookups] == [True]
@@ -0,0 +1,64 @@
+import time
+
+import pandas as pd
+import pytest
+
+from enrich import DiskCache, SpotifyClient, enrich_artists, enrich_tracks
+from spotify_mock_server import MockSpotifyServer
+
+
+@pytest.fixture
+def tracks():
+    artists = ["Artist {}".format(i) for i in range(8)] + ["Band (Live)"]
+    return pd.DataFrame({
+        "artistName": [artists[i % len(artists)] for i in range(30)],
+        "trackName": ["Song {}{}".format(i, " [Remix]" if i % 7 == 0 else "") for i in range(30)],
+        "n_listens": range(1, 31),
+    })
+
+
+def enrich(server, cache, tracks):
+    client = SpotifyClient("id", "secret", cache, api_url=server.api_url, auth_url=server.auth_url,
+                           max_workers=4, requests_per_second=200, backoff=0.01)
+    track_features, results = enrich_tracks(client, tracks)
+    artists = tracks.groupby("artistName").size().reset_index(name="n_listens")
+    artists, genres = enrich_artists(client, artists, results)
+    return client, track_features, artists, genres
+
+
+def api_requests(server):
+    return sum(n for path, n in server.request_counts.items() if path.startswith("/v1/"))
+
+
+def test_rate_limited_enrichment_matches_unlimited_one(tmp_path, tracks):
+    with MockSpotifyServer() as server:
+        _, expected_tracks, expected_artists, expected_genres = enrich(
+            server, DiskCache(str(tmp_path / "unlimited.sqlite")), tracks)
+
+    with MockSpotifyServer(rate_limit=20, retry_after=1) as server:
+        start = time.perf_counter()
+        client, track_features, artists, genres = enrich(server, DiskCache(str(tmp_path / "cache.sqlite")), tracks)
+        elapsed = time.perf_counter() - start
+    assert server.n_rate_limited > 0
+    # every 429 is retried once the Retry-After delay is over, none of them are lost
+    assert client.n_requests == api_requests(server)
+    assert elapsed >= server.retry_after
+    assert track_features["spotify_id"].notna().all()
+    pd.testing.assert_frame_equal(track_features, expected_tracks)
+    pd.testing.assert_frame_equal(artists, expected_artists)
+    pd.testing.assert_frame_equal(genres, expected_genres)
+
+
+def test_resumed_enrichment_makes_no_requests(tmp_path, tracks):
+    path = str(tmp_path / "cache.sqlite")
+    with MockSpotifyServer(rate_limit=50) as server:
+        _, expected_tracks, expected_artists, expected_genres = enrich(server, DiskCache(path), tracks)
+    assert api_requests(server) > 0
+
+    with MockSpotifyServer(rate_limit=50) as server:
+        client, track_features, artists, genres = enrich(server, DiskCache(path), tracks)
+    assert client.n_requests == 0
+    assert sum(server.request_counts.values()) == 0
+    pd.testing.assert_frame_equal(track_features, expected_tracks)
+    pd.testing.assert_frame_equal(artists, expected_artists)
+    pd.testing.assert_frame_equal(genres, expected_genres)
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_store import load_table
+import genre_classifier as gc
+from genre_classifier import broad_genres, classify_artists
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the if / elif chain of the loop, first match wins
+loop_order = [("Hip Hop", gc.hip_hop_genres), ("Pop", gc.pop_genres), ("Rap", gc.rap_genres), ("R&B", gc.r_b_genres),
+              ("Electronica", gc.electronica_genres), ("Rock", gc.rock_genres), ("Jazz", gc.jazz_genres),
+              ("Classical", gc.classical_genres), ("Indie", gc.indie_genres), ("Folk/Country", gc.folk_country_genres)]
+
+
+def loop_broad_genres(artists_df):
+    """The broad genre of every artist as the per-artist loop the app used before the classifier
+    computed it, from the 'genres' column of the artists table."""
+    artists_broad_genres = []
+    for _, row in artists_df.iterrows():
+        genre_array = row['genres']
+        if str(genre_array) == "nan":
+            artists_broad_genres.append("No Genre")
+            continue
+        specific_genre_array = genre_array[1:-1].replace("'", "").replace(", ", ",").split(",")
+        if len(specific_genre_array) == 1 and specific_genre_array[0] == "":
+            artists_broad_genres.append("No Genre")
+            continue
+        count_array = [0] * len(broad_genres)
+        for specific_genre in specific_genre_array:
+            for name, keywords in loop_order:
+                if any(substring in specific_genre for substring in keywords):
+                    count_array[broad_genres.index(name)] += 1
+                    break
+            else:
+                count_array[broad_genres.index("Other")] += 1
+        max_num = np.array(count_array).max()
+        if count_array.count(max_num) > 1:
+            artists_broad_genres.append("Tie Genre")
+        else:
+            artists_broad_genres.append(broad_genres[np.array(count_array).argmax()])
+    return artists_broad_genres
+
+
+def test_classify_artists_matches_per_artist_loop(tmp_path):
+    artists = load_table(os.path.join(repo_dir, "artists_public.csv"), str(tmp_path))
+    genres = load_table(os.path.join(repo_dir, "genres_public.csv"), str(tmp_path))
+    classified = classify_artists(artists, genres)
+    expected = loop_broad_genres(pd.read_csv(os.path.join(repo_dir, "artists_public.csv")))
+    assert len(expected) == 818
+    assert classified["broad_genres"].tolist() == expected
@@ -0,0 +1,130 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from data_store import apply_schema
+from ingest import StreamStore
+
+
+def streams(start, n):
+    """n streams every 7 hours from stream number start, in the format of the json exports."""
+    return [{"endTime": (pd.Timestamp("2020-01-20") + pd.Timedelta(hours=7 * i)).strftime("%Y-%m-%d %H:%M"),
+             "artistName": "Artist {}".format(i % 5), "trackName": "Track {}".format(i % 11), "msPlayed": 1000 * i}
+            for i in range(start, start + n)]
+
+
+def write_export(path, records):
+    with open(path, "w") as f:
+        json.dump(records, f)
+    return str(path)
+
+
+def stored_keys(store):
+    df = store.load()
+    return sorted(zip(df["endTime"].astype(str), df["artistName"].astype(str), df["trackName"].astype(str), df["msPlayed"]))
+
+
+def export_keys(records):
+    return sorted((str(pd.Timestamp(r["endTime"])), r["artistName"], r["trackName"], r["msPlayed"]) for r in records)
+
+
+@pytest.fixture
+def exports(tmp_path):
+    # the second export overlaps the first one, as exports requested a month apart do, and
+    # the first one repeats a stream
+    first = streams(0, 200)
+    second = streams(150, 200)
+    return (write_export(tmp_path / "StreamingHistory0.json", first + first[:3]),
+            write_export(tmp_path / "StreamingHistory1.json", second), first + second[50:])
+
+
+def test_overlapping_exports_are_stored_once(tmp_path, exports):
+    first, second, expected = exports
+    store = StreamStore(str(tmp_path / "store"), "America/Los_Angeles")
+    assert store.ingest([first, second], chunk_size=64) == {first: 200, second: 150}
+    assert stored_keys(store) == export_keys(expected)
+    # the months of the partitions are local months
+    local = pd.to_datetime([r["endTime"] for r in expected]).tz_localize("UTC").tz_convert("America/Los_Angeles")
+    months = {os.path.basename(p)[len("month="):] for p in glob.glob(str(tmp_path / "store" / "month=*"))}
+    assert months == set(local.strftime("%Y-%m"))
+
+
+def test_rerun_adds_no_streams(tmp_path, exports):
+    first, second, expected = exports
+    StreamStore(str(tmp_path / "store")).ingest([first, second], chunk_size=64)
+
+    store = StreamStore(str(tmp_path / "store"))
+    assert store.ingest([first, second], chunk_size=64) == {first: 0, second: 0}
+    # a copy of an export is read again but none of its streams are new
+    copy = write_export(tmp_path / "StreamingHistory1 (1).json", json.load(open(second)))
+    assert store.ingest_file(copy, chunk_size=64) == 0
+    assert stored_keys(store) == export_keys(expected)
+
+
+@pytest.mark.parametrize("interrupted", ["before the hashes", "before the parts are renamed"])
+def test_interrupted_chunk_is_recovered(tmp_path, monkeypatch, exports, interrupted):
+    first, second, expected = exports
+    path = str(tmp_path / "store")
+    StreamStore(path).ingest_file(first, chunk_size=64)
+
+    # the second chunk of the second export fails before its commit point, or right after it
+    calls = []
+    save, replace = np.save, os.replace
+
+    def failing_save(f, array):
+        calls.append(f)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        save(f, array)
+
+    def failing_replace(src, dst):
+        if src.endswith(".parquet.tmp") and "-00001" in src:
+            raise OSError("disk full")
+        replace(src, dst)
+
+    if interrupted == "before the hashes":
+        monkeypatch.setattr(ingest.np, "save", failing_save)
+    else:
+        monkeypatch.setattr(ingest.os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        StreamStore(path).ingest_file(second, chunk_size=64)
+    monkeypatch.undo()
+    assert glob.glob(os.path.join(path, "month=*", "*.parquet.tmp"))
+
+    store = StreamStore(path)
+    store.ingest_file(second, chunk_size=64)
+    assert not glob.glob(os.path.join(path, "month=*", "*.tmp"))
+    assert stored_keys(store) == export_keys(expected)
+
+
+def test_interrupted_manifest_write_keeps_the_previous_manifest(tmp_path, monkeypatch, exports):
+    first, second, _ = exports
+    path = str(tmp_path / "store")
+    StreamStore(path).ingest_file(first, chunk_size=64)
+
+    def failing_dump(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(ingest.json, "dump", failing_dump)
+    with pytest.raises(OSError):
+        StreamStore(path).ingest_file(second, chunk_size=64)
+    monkeypatch.undo()
+
+    store = StreamStore(path)
+    assert store.manifest["batches"] == 1
+    assert store.ingest_file(second, chunk_size=64) == 150
+
+
+def test_csv_round_trip(tmp_path, exports):
+    first, second, _ = exports
+    store = StreamStore(str(tmp_path / "store"), "America/Los_Angeles")
+    store.ingest([first, second], chunk_size=64)
+    store.to_csv(str(tmp_path / "streaming_history_store.csv"))
+
+    df = apply_schema(pd.read_csv(tmp_path / "streaming_history_store.csv"), "streaming_history")
+    expected = store.load()
+    pd.testing.assert_frame_equal(df[expected.columns], expected, check_categorical=False)
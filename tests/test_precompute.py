@@ -0,0 +1,78 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import precompute
+from datasets import Dataset
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def history(tmp_path):
+    """The public data source copied as 'inc' and 'full', with its streams sorted by time, and the
+    lines of that streaming history."""
+    sh = pd.read_csv(os.path.join(repo_dir, "streaming_history_public.csv"))
+    sh = sh.iloc[pd.to_datetime(sh["endTime_utc"], utc=True).argsort(kind="stable")]
+    sh.to_csv(tmp_path / "streaming_history_full.csv", index=False)
+    for table in ["track_features", "artists", "genres"]:
+        for name in ["inc", "full"]:
+            shutil.copyfile(os.path.join(repo_dir, "{}_public.csv".format(table)),
+                            tmp_path / "{}_{}.csv".format(table, name))
+    return (tmp_path / "streaming_history_full.csv").read_bytes().splitlines(keepends=True)
+
+
+def write_streams(tmp_path, lines, fraction):
+    n = int((len(lines) - 1) * fraction)
+    (tmp_path / "streaming_history_inc.csv").write_bytes(b"".join(lines[:n + 1]))
+
+
+def assert_bundles_equal(updated, built):
+    names = [name for name in built.manifest["artifacts"] if not name.startswith("merge_data:streams/")]
+    assert sorted(names) == sorted(name for name in updated.manifest["artifacts"]
+                                   if not name.startswith("merge_data:streams/"))
+    for name in names:
+        key, _, param = name.partition("/")
+        params = (param,) if param else ()
+        pd.testing.assert_frame_equal(updated.load(key, params), built.load(key, params), obj=name)
+    pd.testing.assert_frame_equal(updated.load("merge_data"), built.load("merge_data"))
+
+
+@pytest.mark.parametrize("max_points", [precompute.metric_max_points, 200])
+def test_update_matches_full_build(tmp_path, monkeypatch, history, max_points):
+    # with 200 points the metrics have more points than the scatter plot shows and the
+    # updates add to their cells and samples
+    monkeypatch.setattr(precompute, "metric_max_points", max_points)
+    monkeypatch.chdir(tmp_path)
+    dataset = Dataset("inc", str(tmp_path))
+    write_streams(tmp_path, history, 0.5)
+    precompute.precompute(dataset, workers=2)
+    for fraction in [0.7, 1.0]:
+        write_streams(tmp_path, history, fraction)
+        manifest, reason = precompute.update(dataset)
+        assert reason is None
+        assert manifest["appended_streams"] > 0
+    assert manifest["increment"]["stream_parts"] == 3
+    assert any(name.startswith("chart_data:metric_cells/") for name in manifest["artifacts"]) == (max_points == 200)
+
+    full = Dataset("full", str(tmp_path))
+    precompute.precompute(full, workers=2)
+    assert_bundles_equal(precompute.open_bundle(dataset), precompute.open_bundle(full))
+
+
+def test_failed_update_removes_building_bundle(tmp_path, monkeypatch, history):
+    monkeypatch.chdir(tmp_path)
+    dataset = Dataset("inc", str(tmp_path))
+    write_streams(tmp_path, history, 0.5)
+    precompute.precompute(dataset, workers=2)
+    write_streams(tmp_path, history, 1.0)
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(precompute, "write_artifact", fail)
+    with pytest.raises(OSError):
+        precompute.update(dataset)
+    assert not os.path.exists(precompute.bundle_path(dataset) + ".building")
+    assert os.path.exists(os.path.join(precompute.bundle_path(dataset), "manifest.json"))
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from shared_cache import SharedCache, nbytes
+
+
+class StopScript(BaseException):
+    """Like the exception Streamlit stops a script run with, not an Exception."""
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def start(target):
+    result = {}
+
+    def run():
+        try:
+            result["value"] = target()
+        except BaseException as e:
+            result["error"] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def blocking_build(started, release, value):
+    def build():
+        started.set()
+        assert release.wait(5)
+        return value
+    return build
+
+
+def test_concurrent_gets_build_once():
+    cache = SharedCache(1 << 20)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def build():
+        calls.append(1)
+        return blocking_build(started, release, np.arange(10))()
+    threads = [start(lambda: cache.get(("d", "a"), build)) for _ in range(8)]
+    assert started.wait(5)
+    wait_for(lambda: cache.counts["waits"] == 7)
+    release.set()
+    for thread, _ in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    values = [result["value"] for _, result in threads]
+    assert all(value is values[0] for value in values)
+    assert cache.metrics()["misses"] == 1 and cache.metrics()["waits"] == 7
+    assert cache.get(("d", "a"), build) is values[0]
+    assert cache.metrics()["hits"] == 1
+
+
+def test_waiter_builds_when_the_owner_is_interrupted():
+    cache = SharedCache(1 << 20)
+    started, release = threading.Event(), threading.Event()
+
+    def interrupted_build():
+        started.set()
+        assert release.wait(5)
+        raise StopScript()
+    owner, owner_result = start(lambda: cache.get(("d", "a"), interrupted_build))
+    assert started.wait(5)
+    waiter, waiter_result = start(lambda: cache.get(("d", "a"), lambda: "built by the waiter"))
+    wait_for(lambda: cache.counts["waits"] == 1)
+    release.set()
+    owner.join()
+    waiter.join()
+
+    assert isinstance(owner_result["error"], StopScript)
+    assert waiter_result == {"value": "built by the waiter"}
+    assert cache.get(("d", "a"), lambda: "built again") == "built by the waiter"
+    assert not cache.building
+
+
+def test_build_error_reaches_the_waiters_and_is_not_cached():
+    cache = SharedCache(1 << 20)
+    started, release = threading.Event(), threading.Event()
+    error = ValueError("bad table")
+
+    def failing_build():
+        started.set()
+        assert release.wait(5)
+        raise error
+    owner, owner_result = start(lambda: cache.get(("d", "a"), failing_build))
+    assert started.wait(5)
+    waiters = [start(lambda: cache.get(("d", "a"), lambda: "never built")) for _ in range(3)]
+    wait_for(lambda: cache.counts["waits"] == 3)
+    release.set()
+    for thread, _ in [(owner, owner_result)] + waiters:
+        thread.join()
+
+    assert owner_result["error"] is error
+    assert all(result["error"] is error for _, result in waiters)
+    assert cache.metrics()["entries"] == 0 and not cache.building
+    assert cache.get(("d", "a"), lambda: "fixed") == "fixed"
+
+
+def test_least_recently_used_entries_are_evicted_over_the_budget():
+    size = nbytes(np.zeros(1000))
+    cache = SharedCache(3 * size)
+    for name in "abc":
+        cache.get(("d", name), lambda: np.zeros(1000))
+    # a is used again, so b is the least recently used when d is added
+    cache.get(("d", "a"), lambda: pytest.fail("a is cached"))
+    cache.get(("d", "d"), lambda: np.zeros(1000))
+    assert list(cache.entries) == [("d", "c"), ("d", "a"), ("d", "d")]
+    assert cache.total_bytes == 3 * size
+    assert cache.metrics()["evictions"] == 1
+
+    # an entry larger than the budget is kept on its own
+    cache.get(("e", "big"), lambda: np.zeros(5000))
+    assert list(cache.entries) == [("e", "big")]
+    assert cache.total_bytes == nbytes(np.zeros(5000))
+
+    cache.clear("e")
+    assert cache.metrics()["entries"] == 0 and cache.total_bytes == 0